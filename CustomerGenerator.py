@@ -1,14 +1,18 @@
 import os
 from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
-from typing_extensions import Literal, TypedDict, NotRequired
-from typing import List
+from typing_extensions import Literal
+from typing import List, Optional
 from pydantic import BaseModel, Field
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
 import json
 import time
+import random
+import asyncio
+from collections import Counter
 
 if not os.getenv("API_KEY"):
     raise ValueError("API_KEY environment variable is not set. Please set it to your OpenAI API key.")
@@ -17,6 +21,12 @@ llm = ChatOpenAI(
     api_key = os.getenv("API_KEY", ""),
     base_url = os.getenv("BASE_URL", ""),
 )
+# 并发请求上限，避免超出服务商的RPM限制
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "5"))
+# 每次LLM调用生成的顾客数，摊薄提示词中固定部分的开销
+CUSTOMERS_PER_CALL = int(os.getenv("CUSTOMERS_PER_CALL", "8"))
+# Batch API 轮询间隔（秒）
+BATCH_POLL_INTERVAL = int(os.getenv("BATCH_POLL_INTERVAL", "30"))
 
 # 1. 定义数据结构 (Pydantic Models)
 # =======================================
@@ -45,103 +55,288 @@ class Customer(BaseModel):
     profile: CustomerProfile = Field(..., description="顾客的个人信息")
     order_history: List[Order] = Field(..., description="顾客的历史订单列表")
 
+class CustomerBatch(BaseModel):
+    """一次LLM调用生成的多位顾客"""
+    customers: List[Customer] = Field(..., description="互不相同的顾客列表")
 
-# 2. 定义 Agent 的状态 (State)
+
+# 2. 定义生成逻辑 (Generation)
 # =======================================
-class CustomerGenerationState(TypedDict):
+# 本地预采样多样性提示时使用的候选职业
+OCCUPATION_POOL = [
+    "花艺师", "古董修复师", "数据分析师", "儿科医生", "健身教练", "独立游戏开发者",
+    "市场营销专员", "餐厅服务员", "退休干部", "学生", "教师", "程序员", "公务员",
+    "自由职业", "演员", "自媒体", "护士", "建筑设计师", "快递分拣员", "律师",
+]
+
+# 固定的系统提示词放在消息最前面，每次调用保持一致，可命中服务商的前缀缓存
+SYSTEM_PROMPT = """
+请你扮演一个富有创造力的数据模拟器。你的任务是生成**独特、具体且符合逻辑**的顾客信息，同一次生成的多位顾客之间应彼此互不相同。
+
+请为每位顾客生成详细的个人画像和3条历史订单记录。
+
+**个人画像 (Profile):**
+*   **ID (customer_id)**: 请生成一个基于当前时间戳的整数ID。
+*   **年龄 (age)**: 请在18到60岁之间随机选择一个年龄。
+*   **性别 (gender)**: "男"、"女" 或 "其他"，请确保性别分布多样。
+*   **职业 (occupation)**: 请从一个广泛的职业列表中选择，并可以进行创造性发挥。例如：**花艺师、古董修复师、数据分析师、儿科医生、健身教练、独立游戏开发者、市场营销专员、餐厅服务员、退休干部**等。力求职业的多样性。
+*   **性格 (personality)**: 请用2-3个词描述其性格。例如：**精打细算、追求新潮、工作狂、养生达人、社交恐惧、美食家**。性格应与其职业和消费习惯相关。
+*   **经济条件 (economic_condition)**: "宽裕"、"普通" 或 "紧张"。
+
+**历史订单 (Order History):**
+*   订单内容(`order_type`)应与顾客的**职业、性格和经济条件**高度相关。
+*   订单的其他字段（金额、距离、评分、评价）也需要符合逻辑。
+
+请严格按照要求的JSON格式输出，确保数据充满多样性和真实感。
+"""
+
+def build_customer_prompt(history_prompt: str, k: int = 1) -> str:
     """
-    Agent的状态，用于在图的节点之间传递数据。
+    构建每次调用变化的用户消息，只包含生成数量和多样性提示。
     """
-    # 要生成的顾客总数
-    num_to_generate: int
-    # 已生成的顾客信息列表，作为记忆模块
-    past_customers: List[Customer]
-    # 最新生成的顾客数据
-    generated_customer: NotRequired[Customer]
+    return f"请生成{k}位顾客。\n{history_prompt}"
 
+def build_customer_messages(history_prompt: str, k: int = 1) -> List[BaseMessage]:
+    """
+    组合固定的系统提示词和本次调用的用户消息。
+    """
+    return [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=build_customer_prompt(history_prompt, k))]
 
-# 3. 定义 Agent 的节点 (Nodes)
-# =======================================
-def generate_customer_node(state: CustomerGenerationState):
+def sample_diversity_hint(rng: random.Random) -> str:
     """
-    根据已有记忆生成一个新的、不重复的顾客信息。
+    在本地随机采样一组画像约束，代替把已生成顾客列表发给LLM，使各次请求互不依赖。
     """
-    print("---正在进入顾客生成节点---")
-    
-    past_customers_summary = []
-    if state["past_customers"]:
-        for customer in state["past_customers"]:
-            past_customers_summary.append(f"- 职业: {customer.profile.occupation}, 年龄: {customer.profile.age}, 性别: {customer.profile.gender}")
-    
-    history_prompt = "你已经生成了以下顾客，请避免与他们过于相似：\n" + "\n".join(past_customers_summary) if past_customers_summary else "这是你要生成的第一个顾客。"
+    age = rng.randint(18, 60)
+    gender = rng.choice(["男", "女", "其他"])
+    occupation = rng.choice(OCCUPATION_POOL)
+    economic_condition = rng.choice(["宽裕", "普通", "紧张"])
+    return f"年龄约{age}岁、性别为{gender}、经济条件{economic_condition}，职业可参考「{occupation}」或与之相近的领域"
 
-    prompt = f'''
-    请你扮演一个富有创造力的数据模拟器。你的任务是生成一个**独特、具体且符合逻辑**的顾客信息。
+def format_diversity_hints(hints: List[str]) -> str:
+    """
+    将一组画像约束拼接为提示词，每条约束对应一位待生成的顾客。
+    """
+    if len(hints) == 1:
+        return f"请生成一位{hints[0]}的顾客。"
+    lines = [f"- 第{i + 1}位: {hint}" for i, hint in enumerate(hints)]
+    return "请依次按照以下画像约束生成顾客：\n" + "\n".join(lines)
 
-    {history_prompt}
+class DiversityDigest:
+    """
+    已生成顾客的分布摘要。
 
-    请为这位顾客生成详细的个人画像和3条历史订单记录。
+    只统计职业、年龄段和性别的计数，提示词长度不随已生成顾客数增长。
+    """
+
+    def __init__(self, top_k: int = 5):
+        self.top_k = top_k
+        self.total = 0
+        self.occ_counts: Counter = Counter()
+        self.age_bucket_counts: Counter = Counter()
+        self.gender_counts: Counter = Counter()
+
+    def update(self, customer: Customer):
+        """将新生成的顾客计入分布"""
+        profile = customer.profile
+        self.total += 1
+        self.occ_counts[profile.occupation] += 1
+        bucket = profile.age // 10 * 10
+        self.age_bucket_counts[f"{bucket}-{bucket + 9}岁"] += 1
+        self.gender_counts[profile.gender] += 1
+
+    def render(self) -> str:
+        """生成用于提示LLM避免重复的摘要文本"""
+        if not self.total:
+            return "这是你要生成的第一批顾客。"
+        occupations = "、".join(f"{occ}({count})" for occ, count in self.occ_counts.most_common(self.top_k))
+        age_buckets = "、".join(f"{bucket}({count})" for bucket, count in self.age_bucket_counts.most_common())
+        genders = "、".join(f"{gender}({count})" for gender, count in self.gender_counts.most_common())
+        return (
+            f"你已经生成了{self.total}位顾客。已生成职业分布: {occupations}，请避免这些职业。\n"
+            f"年龄段分布: {age_buckets}；性别分布: {genders}。请优先补充出现较少的年龄段和性别。"
+        )
 
-    **个人画像 (Profile):**
-    *   **ID (customer_id)**: 请生成一个基于当前时间戳的整数ID。
-    *   **年龄 (age)**: 请在18到60岁之间随机选择一个年龄。
-    *   **性别 (gender)**: "男"、"女" 或 "其他"，请确保性别分布多样。
-    *   **职业 (occupation)**: 请从一个广泛的职业列表中选择，并可以进行创造性发挥。例如：**花艺师、古董修复师、数据分析师、儿科医生、健身教练、独立游戏开发者、市场营销专员、餐厅服务员、退休干部**等。力求职业的多样性。
-    *   **性格 (personality)**: 请用2-3个词描述其性格。例如：**精打细算、追求新潮、工作狂、养生达人、社交恐惧、美食家**。性格应与其职业和消费习惯相关。
-    *   **经济条件 (economic_condition)**: "宽裕"、"普通" 或 "紧张"。
+def generate_customer_batch(digest: DiversityDigest, remaining: int) -> List[Customer]:
+    """
+    根据已有记忆生成一批新的、不重复的顾客信息。
+
+    Args:
+        digest: 已生成顾客的分布摘要，用于提示LLM避免重复。
+        remaining: 仍需生成的顾客数量，本批最多生成这么多位。
 
-    **历史订单 (Order History):**
-    *   订单内容(`order_type`)应与顾客的**职业、性格和经济条件**高度相关。
-    *   订单的其他字段（金额、距离、评分、评价）也需要符合逻辑。
+    Returns:
+        本批新生成的顾客列表。
+    """
+    history_prompt = digest.render()
 
-    请严格按照要求的JSON格式输出，确保数据充满多样性和真实感。
-    '''
+    # 一次调用生成多位顾客，最后一批只生成剩余数量
+    k = max(1, min(CUSTOMERS_PER_CALL, remaining))
+    messages = build_customer_messages(history_prompt, k)
     
-    structured_llm = llm.with_structured_output(Customer, method='function_calling')
-    generated_customer = structured_llm.invoke(prompt)
+    structured_llm = llm.with_structured_output(CustomerBatch, method='function_calling')
+    generated_customers = structured_llm.invoke(messages).customers[:remaining]
     
-    # 使用时间戳确保ID的独特性
-    generated_customer.profile.customer_id = int(time.time() * 1000)
-
-    print(f"---成功生成顾客: {generated_customer.profile.customer_id} (职业: {generated_customer.profile.occupation})---")
+    # 使用时间戳确保ID的独特性，同一批次内加上序号
+    for i, generated_customer in enumerate(generated_customers):
+        generated_customer.profile.customer_id = time.time_ns() + i
+        print(f"---成功生成顾客: {generated_customer.profile.customer_id} (职业: {generated_customer.profile.occupation})---")
     
-    # 更新状态，将新生成的顾客加入记忆
-    return {
-        "past_customers": state["past_customers"] + [generated_customer],
-    }
+    return generated_customers
 
-def should_continue(state: CustomerGenerationState) -> Literal["continue", "end"]:
+def generate_customers(n: int) -> List[Customer]:
     """
-    条件节点，判断是否继续生成。
+    逐批生成n位顾客，每一批都参考已生成的顾客以避免重复。
     """
-    if len(state["past_customers"]) < state["num_to_generate"]:
-        print(f"---已生成 {len(state['past_customers'])}/{state['num_to_generate']}，继续生成...---")
-        return "continue"
-    else:
-        print(f"---已生成 {len(state['past_customers'])}/{state['num_to_generate']}，任务结束。---")
-        return "end"
+    customers: List[Customer] = []
+    # 只维护分布计数，提示词长度与已生成数量无关
+    digest = DiversityDigest()
+    while len(customers) < n:
+        generated_customers = generate_customer_batch(digest, n - len(customers))
+        if not generated_customers:
+            print("错误：LLM未返回任何顾客，提前结束生成。")
+            break
+        customers.extend(generated_customers)
+        for customer in generated_customers:
+            digest.update(customer)
+        print(f"---已生成 {len(customers)}/{n}---")
+    return customers
 
-# 4. 构建图 (Graph)
-# =======================================
-# 使用内存作为Checkpointer
-memory = MemorySaver()
-workflow = StateGraph(CustomerGenerationState)
-
-workflow.add_node("generate_customer", generate_customer_node)
-workflow.add_conditional_edges(
-    "generate_customer",
-    should_continue,
-    {
-        "continue": "generate_customer",  # 如果需要继续，则再次调用生成节点
-        "end": END,                     # 否则结束
-    },
-)
-workflow.set_entry_point("generate_customer")
+async def generate_many(n: int, max_concurrency: int = MAX_CONCURRENCY, seed: Optional[int] = None,
+                        customers_per_call: int = CUSTOMERS_PER_CALL) -> List[Customer]:
+    """
+    并发生成n位顾客。
 
-# 编译图，并加入Checkpointer
-app = workflow.compile(checkpointer=memory)
+    每位顾客的多样性提示在本地预先采样，各请求之间没有依赖，
+    因此可以通过 asyncio.gather 同时发出，并用信号量控制并发数。
+    每次调用生成 customers_per_call 位顾客以摊薄提示词的固定开销。
 
-# 5. 运行 Agent
+    Args:
+        n: 要生成的顾客数量。
+        max_concurrency: 同时进行的LLM请求上限。
+        seed: 多样性提示采样的随机种子。
+        customers_per_call: 每次LLM调用生成的顾客数。
+
+    Returns:
+        生成的顾客列表，顺序与提示词顺序一致。
+    """
+    rng = random.Random(seed)
+    # 每个提示词负责 customers_per_call 位顾客，最后一个提示词负责剩余部分
+    prompts = []
+    for start in range(0, n, customers_per_call):
+        hints = [sample_diversity_hint(rng) for _ in range(min(customers_per_call, n - start))]
+        prompts.append((start, len(hints), build_customer_messages(format_diversity_hints(hints), len(hints))))
+    structured_llm = llm.with_structured_output(CustomerBatch, method='function_calling')
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def generate_chunk(start: int, k: int, messages: List[BaseMessage]) -> List[Customer]:
+        async with semaphore:
+            generated_customers = (await structured_llm.ainvoke(messages)).customers[:k]
+        for j, generated_customer in enumerate(generated_customers):
+            # 并发场景下毫秒时间戳可能重复，改用纳秒时间戳加序号
+            generated_customer.profile.customer_id = time.time_ns() + start + j
+            print(f"---成功生成顾客 {start + j + 1}/{n}: {generated_customer.profile.customer_id} (职业: {generated_customer.profile.occupation})---")
+        return generated_customers
+
+    chunks = await asyncio.gather(*(generate_chunk(start, k, messages) for start, k, messages in prompts))
+    return [customer for chunk in chunks for customer in chunk]
+
+def build_batch_jsonl(n: int, path: str, seed: Optional[int] = None) -> str:
+    """
+    为Batch API写出n条顾客生成请求，每行一个 /v1/chat/completions 请求。
+
+    请求体与 with_structured_output(method='function_calling') 使用相同的函数定义，
+    并强制模型调用该函数。
+
+    Args:
+        n: 要生成的顾客数量。
+        path: JSONL文件路径。
+        seed: 多样性提示采样的随机种子。
+
+    Returns:
+        写出的JSONL文件路径。
+    """
+    rng = random.Random(seed)
+    tool = convert_to_openai_tool(Customer)
+    tool_name = tool["function"]["name"]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n):
+            request = {
+                "custom_id": f"cust-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": llm.model_name,
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": build_customer_prompt(format_diversity_hints([sample_diversity_hint(rng)]))},
+                    ],
+                    "tools": [tool],
+                    "tool_choice": {"type": "function", "function": {"name": tool_name}},
+                },
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return path
+
+def parse_batch_output(content: str) -> List[Customer]:
+    """
+    解析Batch API的输出文件内容，按 custom_id 顺序返回顾客列表。失败的请求会被跳过。
+    """
+    results = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        custom_id = record.get("custom_id", "")
+        try:
+            message = record["response"]["body"]["choices"][0]["message"]
+            arguments = message["tool_calls"][0]["function"]["arguments"]
+            results.append((int(custom_id.split("-")[-1]), Customer.model_validate_json(arguments)))
+        except Exception as e:
+            print(f"错误：批处理请求 {custom_id} 解析失败: {record.get('error') or e}")
+    results.sort(key=lambda item: item[0])
+    return [customer for _, customer in results]
+
+def run_batch_job(n: int, input_path: str = './initdata/customer_batch_input.jsonl',
+                  poll_interval: int = BATCH_POLL_INTERVAL) -> List[Customer]:
+    """
+    通过Batch API离线生成n位顾客：上传请求文件、创建批处理任务并轮询直到结束。
+
+    Args:
+        n: 要生成的顾客数量。
+        input_path: 批处理请求JSONL文件的保存路径。
+        poll_interval: 轮询任务状态的间隔（秒）。
+
+    Returns:
+        生成的顾客列表；任务失败时返回空列表。
+    """
+    client = OpenAI(api_key=os.getenv("API_KEY", ""), base_url=os.getenv("BASE_URL") or None)
+    build_batch_jsonl(n, input_path)
+    with open(input_path, 'rb') as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"---已提交批处理任务: {batch.id}---")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        print(f"---批处理任务状态: {batch.status}---")
+
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"错误：批处理任务未成功完成，状态: {batch.status}")
+        return []
+
+    customers = parse_batch_output(client.files.content(batch.output_file_id).text)
+    for i, customer in enumerate(customers):
+        customer.profile.customer_id = time.time_ns() + i
+    print(f"---批处理任务完成，成功生成 {len(customers)}/{n} 位顾客---")
+    return customers
+
+# 3. 运行 Agent
 # =======================================
 def save_customers_to_json(customers_list: List[Customer], file_path: str = './initdata/customer.json'):
     """
@@ -156,39 +351,39 @@ def save_customers_to_json(customers_list: List[Customer], file_path: str = './i
         # 确保目录存在，如果不存在则创建
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         
-        # 将Pydantic对象列表转换为字典列表
-        customers_dict_list = [customer.dict() for customer in customers_list]
-        
-        # 写入JSON文件，使用 utf-8 编码以支持中文
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(customers_dict_list, f, indent=2, ensure_ascii=False)
+        # 由Pydantic的序列化器直接输出UTF-8字节，逐个写入，不构建中间的字典列表
+        serializer = Customer.__pydantic_serializer__
+        last = len(customers_list) - 1
+        with open(file_path, 'wb') as f:
+            f.write(b'[\n')
+            for i, customer in enumerate(customers_list):
+                f.write(serializer.to_json(customer, indent=2))
+                f.write(b',\n' if i < last else b'\n')
+            f.write(b']\n')
             
-        print(f"--- 成功保存 {len(customers_dict_list)} 位顾客信息到 {file_path} ---")
+        print(f"--- 成功保存 {len(customers_list)} 位顾客信息到 {file_path} ---")
     except Exception as e:
         print(f"错误：保存文件时发生异常: {e}")
 
 if __name__ == "__main__":
     NUMBER_OF_CUSTOMERS_TO_GENERATE = 3
+    # async: 并发生成（默认）；sequential: 逐批生成并参考已生成顾客去重；
+    # batch: 通过Batch API离线生成
+    GENERATION_MODE = os.getenv("GENERATION_MODE", "async")
     print(f"开始运行顾客生成器 Agent，目标生成 {NUMBER_OF_CUSTOMERS_TO_GENERATE} 位顾客...")
 
-    # 配置一个唯一的会话ID，用于记忆
-    config = {"configurable": {"thread_id": "customer-generation-thread"}}
-    
-    # 定义初始状态
-    initial_state = {
-        "num_to_generate": NUMBER_OF_CUSTOMERS_TO_GENERATE,
-        "past_customers": [],
-    }
-
-    # 运行Agent
-    final_state = app.invoke(initial_state, config=config)
-    
-    generated_customers_list = final_state.get('past_customers', [])
+    if GENERATION_MODE == "sequential":
+        generated_customers_list = generate_customers(NUMBER_OF_CUSTOMERS_TO_GENERATE)
+    elif GENERATION_MODE == "batch":
+        generated_customers_list = run_batch_job(NUMBER_OF_CUSTOMERS_TO_GENERATE)
+    else:
+        generated_customers_list = asyncio.run(generate_many(NUMBER_OF_CUSTOMERS_TO_GENERATE))
 
     if generated_customers_list:
         print("\n最终生成的全部顾客信息：")
-        customers_dict_list = [customer.dict() for customer in generated_customers_list]
-        print(json.dumps(customers_dict_list, indent=2, ensure_ascii=False))
+        # 逐个输出，不先构建全部顾客的字典列表
+        for customer in generated_customers_list:
+            print(customer.model_dump_json(indent=2))
         save_customers_to_json(generated_customers_list)
 
 
@@ -7,7 +7,6 @@ from typing import List
 from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
-import json
 import time
 
 if not os.getenv("API_KEY"):
@@ -151,10 +150,16 @@ def save_riders_to_json(riders_list: List[Rider], file_path: str = './initdata/r
     print(f"\n--- 正在将生成的骑手信息保存到 {file_path} ---")
     try:
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        riders_dict_list = [rider.dict() for rider in riders_list]
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(riders_dict_list, f, indent=2, ensure_ascii=False)
-        print(f"--- 成功保存 {len(riders_dict_list)} 位骑手信息到 {file_path} ---")
+        # 逐个序列化写入，不在内存中构建全部骑手的字典列表
+        serializer = Rider.__pydantic_serializer__
+        last = len(riders_list) - 1
+        with open(file_path, 'wb') as f:
+            f.write(b'[\n')
+            for i, rider in enumerate(riders_list):
+                f.write(serializer.to_json(rider, indent=2))
+                f.write(b',\n' if i < last else b'\n')
+            f.write(b']\n')
+        print(f"--- 成功保存 {len(riders_list)} 位骑手信息到 {file_path} ---")
     except Exception as e:
         print(f"错误：保存文件时发生异常: {e}")
 
@@ -178,7 +183,7 @@ if __name__ == "__main__":
 
     if generated_riders_list:
         print("\n最终生成的全部骑手信息：")
-        riders_dict_list = [rider.dict() for rider in generated_riders_list]
-        print(json.dumps(riders_dict_list, indent=2, ensure_ascii=False))
+        for rider in generated_riders_list:
+            print(rider.model_dump_json(indent=2))
         save_riders_to_json(generated_riders_list)
 
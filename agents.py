@@ -6,30 +6,127 @@
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, field
 from enum import Enum
+import os
+import sys
 import random
-import uuid
+import itertools
 from collections import deque
 import numpy as np
 
+from environment import EnvState, Environment
+from kernels import delivery_health_loss, rest_recovery, rider_happiness
+
+# 是否记录Agent的观察/思考/行动轨迹，关闭后add_*直接返回；运行时用enable_trace切换
+DEBUG_TRACE = True
+# 每条轨迹保留的最近记录数，更早的记录自动丢弃；None为不限
+TRACE_MAXLEN: Optional[int] = 16
+
+def enable_trace(enabled: bool = True):
+    """打开或关闭所有Agent（包括LLM Agent）的轨迹记录，关闭后已有轨迹保留但不再追加"""
+    global DEBUG_TRACE
+    DEBUG_TRACE = enabled
+
+class TraceLog:
+    """
+    按需格式化的轨迹记录。
+
+    只保存原始文本或(模板, 参数)，读取时才拼接Agent前缀并格式化，
+    行为上与字符串列表相同（支持下标、切片、迭代和len）。
+    最多保留最近maxlen条记录，total为累计记录过的条数。
+    """
+    __slots__ = ("prefix", "_items", "total")
+    
+    def __init__(self, prefix: str, maxlen: Optional[int] = TRACE_MAXLEN):
+        self.prefix = prefix
+        self._items = deque(maxlen=maxlen)
+        self.total = 0
+        
+    def append(self, entry):
+        self._items.append(entry)
+        self.total += 1
+        
+    def _format(self, entry) -> str:
+        if isinstance(entry, tuple):
+            template, args = entry
+            return self.prefix + template.format(*args)
+        return self.prefix + entry
+    
+    def __len__(self) -> int:
+        return len(self._items)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._format(entry) for entry in list(self._items)[index]]
+        return self._format(self._items[index])
+    
+    def __iter__(self):
+        return (self._format(entry) for entry in self._items)
+    
+    def last(self) -> str:
+        """最近一条记录，没有记录时为空字符串"""
+        items = self._items
+        return self._format(items[-1]) if items else ""
+
 class AgentState:
-    """Agent基础状态类"""
+    """
+    Agent基础状态类
+
+    观察/思考/行动轨迹在第一次记录时才创建，从未记录轨迹的Agent不占用这部分内存；
+    未创建时对应属性返回空元组。
+    """
+    __slots__ = ("agent_id", "agent_type", "_observations", "_thoughts", "_actions")
+    
     def __init__(self, agent_id: str, agent_type: str):
         self.agent_id = agent_id
-        self.agent_type = agent_type
-        self.observations = []
-        self.thoughts = []
-        self.actions = []
-        
-    def add_observation(self, obs: str):
-        self.observations.append(f"[{self.agent_type}-{self.agent_id}] 观察: {obs}")
-        
-    def add_thought(self, thought: str):
-        self.thoughts.append(f"[{self.agent_type}-{self.agent_id}] 思考: {thought}")
+        self.agent_type = sys.intern(agent_type)
+        self._observations = None
+        self._thoughts = None
+        self._actions = None
         
-    def add_action(self, action: str):
-        self.actions.append(f"[{self.agent_type}-{self.agent_id}] 行动: {action}")
+    def _new_trace(self, label: str) -> TraceLog:
+        return TraceLog(f"[{self.agent_type}-{self.agent_id}] {label}: ")
+    
+    @property
+    def observations(self):
+        return self._observations if self._observations is not None else ()
+    
+    @property
+    def thoughts(self):
+        return self._thoughts if self._thoughts is not None else ()
+    
+    @property
+    def actions(self):
+        return self._actions if self._actions is not None else ()
+        
+    def add_observation(self, obs: str, *args):
+        """记录观察；传入args时obs为str.format模板，读取时才格式化"""
+        if DEBUG_TRACE:
+            if self._observations is None:
+                self._observations = self._new_trace("观察")
+            self._observations.append((obs, args) if args else obs)
+        
+    def add_thought(self, thought: str, *args):
+        """记录思考；传入args时thought为str.format模板，读取时才格式化"""
+        if DEBUG_TRACE:
+            if self._thoughts is None:
+                self._thoughts = self._new_trace("思考")
+            self._thoughts.append((thought, args) if args else thought)
+        
+    def add_action(self, action: str, *args):
+        """记录行动；传入args时action为str.format模板，读取时才格式化"""
+        if DEBUG_TRACE:
+            if self._actions is None:
+                self._actions = self._new_trace("行动")
+            self._actions.append((action, args) if args else action)
 
-@dataclass
+# 订单ID只作为不透明标识使用，用进程内递增计数器代替uuid4，避免每单读取系统随机源
+_order_id_counter = itertools.count(1)
+
+def next_order_id() -> str:
+    """生成新的订单ID：前8位为进程内序号（日志只显示这部分），后缀进程号使多个进程的仿真结果合并时不冲突"""
+    return f"{next(_order_id_counter):08x}-{os.getpid():04x}"
+
+@dataclass(slots=True)
 class Order:
     """订单数据结构"""
     order_id: str
@@ -41,66 +138,77 @@ class Order:
     delivered: bool = False
     rating: Optional[int] = None
     tip: float = 0.0
+    day: int = 0  # 下单日期
+    row: int = -1  # 在OrderLedger中的行号，未记录为-1
 
 class Customer(AgentState):
     """点外卖群体Agent"""
+    __slots__ = ("_env", "last_ratings", "_rating_sum", "_rating_count", "order_history",
+                 "_order_prob", "_order_prob_key")
     
-    def __init__(self, customer_id: str):
+    def __init__(self, customer_id: str, environment: Optional[Environment] = None):
         super().__init__(customer_id, "Customer")
+        # 下单时用于生成金额和距离，构造时注入一次，不在决策路径中创建
+        self._env = environment if environment is not None else Environment()
         self.last_ratings = deque(maxlen=5)  # 最近5次评分
+        self._rating_sum = 0  # 最近评分之和，随评分增量维护
+        self._rating_count = 0
         self.order_history = []
+        self._order_prob_key = None  # 下单倾向的缓存键
+        self._order_prob = 0.0
         
-    def observe(self, environment_state: Dict) -> str:
+    def _avg_rating(self) -> float:
+        """最近评分均值，没有评分时为5.0"""
+        return self._rating_sum / self._rating_count if self._rating_count else 5.0
+    
+    def _compute_order_prob(self, environment_state: EnvState) -> float:
+        """计算下单倾向（未乘基础概率），同一时刻同一评分只计算一次"""
+        key = (environment_state.hour, environment_state.temperature, self._rating_sum, self._rating_count)
+        if key != self._order_prob_key:
+            # 高温会降低点外卖概率，评分低也会降低概率
+            temp_factor = max(0.1, 1.0 - (environment_state.temperature - 30) / 20)  # 温度越高概率越低
+            rating_factor = self._avg_rating() / 5.0  # 评分越高概率越高
+            meal_factor = 1.5 if environment_state.is_meal_time else 0.3  # 用餐时间概率更高
+            self._order_prob = temp_factor * rating_factor * meal_factor
+            self._order_prob_key = key
+        return self._order_prob
+        
+    def observe(self, environment_state: EnvState) -> str:
         """观察环境状态"""
-        temp = environment_state["temperature"]
-        avg_rating = np.mean(self.last_ratings) if self.last_ratings else 5.0
+        temp = environment_state.temperature
+        avg_rating = self._avg_rating()
         
         obs = f"当前温度{temp:.1f}°C，我的前几次外卖评分均值为{avg_rating:.1f}"
         self.add_observation(obs)
         return obs
     
-    def think(self, environment_state: Dict) -> str:
+    def think(self, environment_state: EnvState) -> str:
         """思考决策"""
-        temp = environment_state["temperature"]
-        avg_rating = np.mean(self.last_ratings) if self.last_ratings else 5.0
-        is_meal_time = environment_state["is_meal_time"]
-        
-        # 高温会降低点外卖概率，评分低也会降低概率
-        temp_factor = max(0.1, 1.0 - (temp - 30) / 20)  # 温度越高概率越低
-        rating_factor = avg_rating / 5.0  # 评分越高概率越高
-        meal_factor = 1.5 if is_meal_time else 0.3  # 用餐时间概率更高
-        
-        order_prob = temp_factor * rating_factor * meal_factor
+        temp = environment_state.temperature
+        avg_rating = self._avg_rating()
+        is_meal_time = environment_state.is_meal_time
+        order_prob = self._compute_order_prob(environment_state)
         
         thought = f"考虑到温度{temp:.1f}°C，服务评分{avg_rating:.1f}，用餐时间{is_meal_time}，点外卖概率为{order_prob:.2f}"
         self.add_thought(thought)
         return thought
     
-    def decide_order(self, environment_state: Dict) -> Optional[Order]:
+    def decide_order(self, environment_state: EnvState) -> Optional[Order]:
         """决定是否下单"""
-        temp = environment_state["temperature"]
-        avg_rating = np.mean(self.last_ratings) if self.last_ratings else 5.0
-        is_meal_time = environment_state["is_meal_time"]
-        
-        # 计算下单概率
-        temp_factor = max(0.1, 1.0 - (temp - 30) / 20)
-        rating_factor = avg_rating / 5.0
-        meal_factor = 1.5 if is_meal_time else 0.3
-        order_prob = temp_factor * rating_factor * meal_factor * 0.3  # 基础概率
+        order_prob = self._compute_order_prob(environment_state) * 0.3  # 基础概率
         
         if random.random() < order_prob:
-            from environment import Environment
-            env = Environment()
+            cost, distance = self._env.draw_order()
             order = Order(
-                order_id=str(uuid.uuid4()),
+                order_id=next_order_id(),
                 customer_id=self.agent_id,
-                time=environment_state["hour"],
-                cost=env.get_order_cost(),
-                distance=env.get_order_distance()
+                time=environment_state.hour,
+                cost=cost,
+                distance=distance,
+                day=environment_state.day
             )
             self.order_history.append(order)
-            action = f"下单 - 订单ID:{order.order_id[:8]}, 金额:{order.cost:.1f}元, 距离:{order.distance:.1f}km"
-            self.add_action(action)
+            self.add_action("下单 - 订单ID:{}, 金额:{:.1f}元, 距离:{:.1f}km", order.order_id[:8], order.cost, order.distance)
             return order
         return None
     
@@ -118,11 +226,16 @@ class Customer(AgentState):
         # 添加随机因素
         rating = max(1, min(5, base_rating + random.randint(-1, 1)))
         
+        # deque已满时追加会挤掉最早的评分，先从累计和中减去
+        if len(self.last_ratings) == self.last_ratings.maxlen:
+            self._rating_sum -= self.last_ratings[0]
+        else:
+            self._rating_count += 1
         self.last_ratings.append(rating)
+        self._rating_sum += rating
         order.rating = rating
         
-        action = f"给订单{order.order_id[:8]}评分{rating}星"
-        self.add_action(action)
+        self.add_action("给订单{}评分{}星", order.order_id[:8], rating)
         return rating
     
     def decide_tip(self, order: Order, rider_health: float) -> float:
@@ -136,12 +249,13 @@ class Customer(AgentState):
             
         order.tip = tip
         if tip > 0:
-            action = f"给订单{order.order_id[:8]}小费{tip:.1f}元"
-            self.add_action(action)
+            self.add_action("给订单{}小费{:.1f}元", order.order_id[:8], tip)
         return tip
 
 class Rider(AgentState):
     """外卖小哥Agent"""
+    __slots__ = ("health", "money", "on_duty", "happiness", "orders_completed", "complaints",
+                 "daily_income")
     
     def __init__(self, rider_id: str):
         super().__init__(rider_id, "Rider")
@@ -153,79 +267,81 @@ class Rider(AgentState):
         self.complaints = []
         self.daily_income = 0.0
         
-    def observe(self, environment_state: Dict, available_orders: List[Order]) -> str:
+    def observe(self, environment_state: EnvState, available_orders: List[Order]) -> str:
         """观察环境状态"""
-        temp = environment_state["temperature"]
-        shelter_rate = environment_state["shelter_rate"]
+        temp = environment_state.temperature
+        shelter_rate = environment_state.shelter_rate
         order_count = len(available_orders)
         
         obs = f"当前温度{temp:.1f}°C，阴凉覆盖率{shelter_rate:.1f}，可接订单{order_count}个，我的健康状况{self.health:.1f}/10"
         self.add_observation(obs)
         return obs
     
-    def think(self, environment_state: Dict, available_orders: List[Order]) -> str:
+    def think(self, environment_state: EnvState, available_orders: List[Order]) -> str:
         """思考决策"""
-        temp = environment_state["temperature"]
+        temp = environment_state.temperature
+        h = self.health
+        order_count = len(available_orders)
         
         # 健康状况判断
-        if self.health < 2:
-            thought = f"健康状况严重恶化({self.health:.1f}/10)，必须休息或就医"
-        elif self.health < 5:
-            thought = f"健康状况较差({self.health:.1f}/10)，需要谨慎工作"
+        if h < 2:
+            thought = f"健康状况严重恶化({h:.1f}/10)，必须休息或就医"
+        elif h < 5:
+            thought = f"健康状况较差({h:.1f}/10)，需要谨慎工作"
         elif temp > 40:
             thought = f"极端高温{temp:.1f}°C，工作风险很高"
-        elif len(available_orders) > 0:
-            thought = f"有{len(available_orders)}个订单可接，考虑接单赚钱"
+        elif order_count > 0:
+            thought = f"有{order_count}个订单可接，考虑接单赚钱"
         else:
             thought = "当前没有订单，等待或休息"
             
         self.add_thought(thought)
         return thought
     
-    def decide_action(self, environment_state: Dict, available_orders: List[Order]) -> str:
+    def decide_action(self, environment_state: EnvState, available_orders: List[Order]) -> str:
         """决定行动"""
         if not self.on_duty:
             return "off_duty"
             
-        temp = environment_state["temperature"]
+        temp = environment_state.temperature
+        h = self.health
+        rand = random.random
         
         # 健康状况太差，必须休息
-        if self.health < 2:
+        if h < 2:
             return "rest"
             
         # 极端高温且健康状况不好，倾向于休息
-        if temp > 42 and self.health < 6:
-            if random.random() < 0.7:
+        if temp > 42 and h < 6:
+            if rand() < 0.7:
                 return "rest"
                 
         # 有订单且健康状况允许，考虑接单
-        if available_orders and self.health >= 3:
+        if available_orders and h >= 3:
             # 根据健康状况和温度决定接单概率
-            health_factor = self.health / 10.0
+            health_factor = h / 10.0
             temp_factor = max(0.1, 1.0 - (temp - 35) / 15)
             work_prob = health_factor * temp_factor
             
-            if random.random() < work_prob:
+            if rand() < work_prob:
                 return "deliver"
                 
         # 健康状况很差，考虑投诉
-        if self.health < 3 and random.random() < 0.3:
+        if h < 3 and rand() < 0.3:
             return "complain"
             
         return "rest"
     
-    def deliver_order(self, order: Order, environment_state: Dict) -> Dict:
+    def deliver_order(self, order: Order, environment_state: EnvState) -> Dict:
         """接单送餐"""
-        temp = environment_state["temperature"]
-        shelter_rate = environment_state["shelter_rate"]
+        temp = environment_state.temperature
+        shelter_rate = environment_state.shelter_rate
         
         # 计算健康损失
-        K = 0.2  # 健康损失系数
-        health_loss = (temp - 35) * K * order.distance * (1 - shelter_rate)
-        health_loss = max(0, health_loss)  # 确保不为负数
+        loss = delivery_health_loss(temp, order.distance, shelter_rate)
         
-        self.health -= health_loss
-        self.health = max(0, self.health)  # 确保健康值不为负
+        health = max(0, self.health - loss)  # 确保健康值不为负
+        self.health = health
         
         # 计算收入（基础收入 + 小费）
         base_income = order.cost * 0.2  # 假设骑手收入为订单金额的20%
@@ -240,57 +356,46 @@ class Rider(AgentState):
         # 更新幸福感
         self.update_happiness(environment_state)
         
-        action = f"完成订单{order.order_id[:8]}，收入{total_income:.1f}元，健康损失{health_loss:.1f}，当前健康{self.health:.1f}/10"
-        self.add_action(action)
+        self.add_action("完成订单{}，收入{:.1f}元，健康损失{:.1f}，当前健康{:.1f}/10", order.order_id[:8], total_income, loss, health)
         
         return {
             "order": order,
             "income": total_income,
-            "health_loss": health_loss
+            "health_loss": loss
         }
     
-    def rest(self, environment_state: Dict):
+    def rest(self, environment_state: EnvState):
         """休息恢复"""
-        rest_rate = environment_state["rest_rate"]
-        temp = environment_state["temperature"]
+        rest_rate = environment_state.rest_rate
+        temp = environment_state.temperature
         
-        # 休息恢复健康
-        if temp > 40:
-            recovery = 0.5 * rest_rate  # 高温下恢复较慢
-        else:
-            recovery = 1.0 * rest_rate
-            
-        self.health += recovery
-        self.health = min(10, self.health)  # 确保健康值不超过10
+        # 休息恢复健康，高温下恢复较慢
+        recovery = rest_recovery(temp, rest_rate)
+        health = min(10, self.health + recovery)  # 确保健康值不超过10
+        self.health = health
         
-        action = f"休息恢复健康{recovery:.1f}，当前健康{self.health:.1f}/10"
-        self.add_action(action)
+        self.add_action("休息恢复健康{:.1f}，当前健康{:.1f}/10", recovery, health)
     
-    def complain(self, environment_state: Dict):
+    def complain(self, environment_state: EnvState):
         """投诉"""
+        h = self.health
+        temp = environment_state.temperature
         complaint = {
             "rider_id": self.agent_id,
-            "day": environment_state["day"],
-            "hour": environment_state["hour"],
-            "health": self.health,
-            "temperature": environment_state["temperature"],
+            "day": environment_state.day,
+            "hour": environment_state.hour,
+            "health": h,
+            "temperature": temp,
             "reason": "极端高温工作条件恶劣，健康受损严重"
         }
         self.complaints.append(complaint)
         
-        action = f"投诉工作条件恶劣，当前健康{self.health:.1f}/10，温度{environment_state['temperature']:.1f}°C"
-        self.add_action(action)
+        self.add_action("投诉工作条件恶劣，当前健康{:.1f}/10，温度{:.1f}°C", h, temp)
         return complaint
     
-    def update_happiness(self, environment_state: Dict):
-        """更新幸福感"""
-        # 基础幸福感受多个因素影响
-        health_factor = self.health / 10.0  # 健康因素
-        money_factor = min(1.0, self.money / 2000.0)  # 收入因素
-        temp_factor = max(0.1, 1.0 - (environment_state["temperature"] - 30) / 20)  # 温度因素
-        
-        self.happiness = (health_factor * 0.4 + money_factor * 0.3 + temp_factor * 0.3) * 10
-        self.happiness = max(0, min(10, self.happiness))
+    def update_happiness(self, environment_state: EnvState):
+        """更新幸福感，受健康、收入和温度影响"""
+        self.happiness = rider_happiness(self.health, self.money, environment_state.temperature)
     
     def get_status(self) -> Dict:
         """获取状态信息"""
@@ -307,6 +412,8 @@ class Rider(AgentState):
 class Platform(AgentState):
     """外卖平台Agent"""
     
+    __slots__ = ("cash", "tax_time", "daily_revenue", "rider_pay_rate")
+    
     def __init__(self):
         super().__init__("platform", "Platform")
         self.cash = 5000.0  # 初始资金
@@ -323,32 +430,32 @@ class Platform(AgentState):
         self.add_observation(obs)
         return obs
     
-    def think(self, riders: List[Rider], environment_state: Dict) -> str:
+    def think(self, riders: List[Rider], environment_state: EnvState) -> str:
         """分析决策"""
         unhealthy_riders = [r for r in riders if r.health < 3]
-        complaints = sum(len(r.complaints) for r in riders)
+        complaints = total_complaints(riders)
         
         thought = f"有{len(unhealthy_riders)}个骑手健康状况不佳，收到{complaints}次投诉，需要考虑应对措施"
         self.add_thought(thought)
         return thought
     
-    def calc_profit(self, orders: List[Order]) -> float:
-        """计算日收益"""
-        daily_orders = [o for o in orders if o.delivered]
-        revenue = sum(o.cost * 0.8 for o in daily_orders)  # 平台抽成80%
+    def calc_profit(self, orders) -> float:
+        """计算日收益，orders可以是订单列表或OrderLedger"""
+        if isinstance(orders, OrderLedger):
+            revenue = orders.delivered_revenue(0.8)  # 平台抽成80%
+        else:
+            revenue = sum(o.cost * 0.8 for o in orders if o.delivered)  # 平台抽成80%
         self.daily_revenue = revenue
         self.cash += revenue
         
-        action = f"今日收益{revenue:.1f}元，累计资金{self.cash:.1f}元"
-        self.add_action(action)
+        self.add_action("今日收益{:.1f}元，累计资金{:.1f}元", revenue, self.cash)
         return revenue
     
     def consider_fire_rider(self, rider: Rider) -> bool:
         """考虑是否解雇骑手"""
         if rider.health < 1 or len(rider.complaints) > 5:
             rider.on_duty = False
-            action = f"解雇骑手{rider.agent_id}，原因：健康状况{rider.health:.1f}或投诉过多"
-            self.add_action(action)
+            self.add_action("解雇骑手{}，原因：健康状况{:.1f}或投诉过多", rider.agent_id, rider.health)
             return True
         return False
     
@@ -358,33 +465,34 @@ class Platform(AgentState):
         self.cash -= tax_amount
         government.receive_tax(tax_amount)
         
-        action = f"向政府缴税{tax_amount:.1f}元"
-        self.add_action(action)
+        self.add_action("向政府缴税{:.1f}元", tax_amount)
         return tax_amount
 
 class Government(AgentState):
     """政府Agent"""
     
+    __slots__ = ("budget", "subsidies_paid", "shelters_built")
+    
     def __init__(self):
         super().__init__("government", "Government")
         self.budget = 0.0  # 预算
         self.subsidies_paid = 0.0
         self.shelters_built = 0
         
-    def observe(self, environment_state: Dict, riders: List[Rider]) -> str:
+    def observe(self, environment_state: EnvState, riders: List[Rider]) -> str:
         """观察环境和骑手状况"""
-        temp = environment_state["temperature"]
-        complaints = sum(len(r.complaints) for r in riders)
+        temp = environment_state.temperature
+        complaints = total_complaints(riders)
         unhealthy_riders = len([r for r in riders if r.health < 5])
         
         obs = f"当前温度{temp:.1f}°C，收到{complaints}次投诉，{unhealthy_riders}个骑手健康状况不佳"
         self.add_observation(obs)
         return obs
     
-    def think(self, environment_state: Dict, riders: List[Rider]) -> str:
+    def think(self, environment_state: EnvState, riders: List[Rider]) -> str:
         """思考政策决策"""
-        temp = environment_state["temperature"]
-        complaints = sum(len(r.complaints) for r in riders)
+        temp = environment_state.temperature
+        complaints = total_complaints(riders)
         
         if temp > 40 and complaints > 2:
             thought = "极端高温且投诉较多，需要采取紧急措施"
@@ -396,9 +504,9 @@ class Government(AgentState):
         self.add_thought(thought)
         return thought
     
-    def decide_subsidy(self, environment_state: Dict, riders: List[Rider]) -> float:
+    def decide_subsidy(self, environment_state: EnvState, riders: List[Rider]) -> float:
         """决定高温补贴"""
-        temp = environment_state["temperature"]
+        temp = environment_state.temperature
         
         if temp > 42:
             subsidy_per_rider = 50  # 极端高温补贴
@@ -417,16 +525,15 @@ class Government(AgentState):
             self.budget -= total_subsidy
             self.subsidies_paid += total_subsidy
             
-            action = f"发放高温补贴，每人{subsidy_per_rider}元，总计{total_subsidy}元"
-            self.add_action(action)
+            self.add_action("发放高温补贴，每人{}元，总计{}元", subsidy_per_rider, total_subsidy)
             return total_subsidy
         return 0
     
-    def decide_build_shelter(self, environment_state: Dict, riders: List[Rider]) -> bool:
+    def decide_build_shelter(self, environment_state: EnvState, riders: List[Rider]) -> bool:
         """决定是否增设纳凉点"""
-        temp = environment_state["temperature"]
-        complaints = sum(len(r.complaints) for r in riders)
-        shelter_rate = environment_state["shelter_rate"]
+        temp = environment_state.temperature
+        complaints = total_complaints(riders)
+        shelter_rate = environment_state.shelter_rate
         
         # 高温且投诉多且覆盖率不够时考虑增设
         if temp > 40 and complaints > 3 and shelter_rate < 0.8:
@@ -434,13 +541,93 @@ class Government(AgentState):
             if self.budget >= cost:
                 self.budget -= cost
                 self.shelters_built += 1
-                action = f"决定增设纳凉点，成本{cost}元"
-                self.add_action(action)
+                self.add_action("决定增设纳凉点，成本{}元", cost)
                 return True
         return False
     
     def receive_tax(self, amount: float):
         """接收税收"""
         self.budget += amount
-        action = f"收到税收{amount:.1f}元，当前预算{self.budget:.1f}元"
-        self.add_action(action)
+        self.add_action("收到税收{:.1f}元，当前预算{:.1f}元", amount, self.budget)
+
+# 订单结构数组的记录格式；rider/customer为群体内下标，未分配骑手为-1
+ORDER_LEDGER_DTYPE = np.dtype([
+    ("cost", "f4"),
+    ("distance", "f4"),
+    ("delivered", "?"),
+    ("day", "i2"),
+    ("rider", "i4"),
+    ("customer", "i4"),
+])
+
+class OrderLedger:
+    """订单的结构数组记录，按下单顺序保存订单的数值字段，供收益、完成率等统计做向量化归约"""
+    
+    def __init__(self, capacity: int = 1024):
+        self._records = np.zeros(max(1, capacity), dtype=ORDER_LEDGER_DTYPE)
+        self.size = 0
+        self._delivered_count = 0  # 随mark_delivered递增，报告时不必扫描记录
+        # 已送达订单金额按下单日累计，日结收益时不必扫描全部历史订单
+        self._delivered_cost_by_day: Dict[int, float] = {}
+        
+    def __len__(self) -> int:
+        return self.size
+    
+    @property
+    def records(self) -> np.ndarray:
+        return self._records[:self.size]
+    
+    @property
+    def costs(self) -> np.ndarray:
+        return self.records["cost"]
+    
+    @property
+    def delivered(self) -> np.ndarray:
+        return self.records["delivered"]
+    
+    def add(self, order: Order, customer: int = -1) -> int:
+        """记录新订单并返回其行号（同时写入order.row），容量不足时按倍数扩容"""
+        if self.size == len(self._records):
+            records = np.zeros(2 * self.size, dtype=ORDER_LEDGER_DTYPE)
+            records[:self.size] = self._records
+            self._records = records
+        row = self.size
+        self._records[row] = (order.cost, order.distance, order.delivered, order.day, -1, customer)
+        if order.delivered:
+            self._count_delivered(self._records[row])
+        order.row = row
+        self.size += 1
+        return row
+        
+    def mark_delivered(self, order: Order, rider: int = -1):
+        """标记订单已送达，rider为配送骑手的下标；订单必须先经add记录"""
+        if not 0 <= order.row < self.size:
+            raise ValueError(f"订单{order.order_id}未记录在OrderLedger中（row={order.row}）")
+        record = self._records[order.row]
+        if not record["delivered"]:
+            record["delivered"] = True
+            self._count_delivered(record)
+        record["rider"] = rider
+    
+    def _count_delivered(self, record):
+        self._delivered_count += 1
+        day = int(record["day"])
+        self._delivered_cost_by_day[day] = self._delivered_cost_by_day.get(day, 0.0) + float(record["cost"])
+    
+    def delivered_count(self) -> int:
+        """已送达的订单数"""
+        return self._delivered_count
+    
+    def completion_rate(self) -> float:
+        """订单完成率，没有订单时为0"""
+        return self._delivered_count / self.size if self.size else 0.0
+    
+    def delivered_revenue(self, share: float, day: Optional[int] = None) -> float:
+        """已送达订单的金额乘以分成比例之和，给定day时只统计当天下单的订单；读取按天累计的金额，不扫描记录"""
+        if day is not None:
+            return self._delivered_cost_by_day.get(day, 0.0) * share
+        return sum(self._delivered_cost_by_day.values()) * share
+
+def total_complaints(riders) -> int:
+    """骑手的投诉总数"""
+    return sum(len(r.complaints) for r in riders)
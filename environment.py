@@ -5,56 +5,93 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
-from typing import Dict, List, Tuple
-import random
+from typing import NamedTuple, Optional, Tuple
 from datetime import datetime, timedelta
 
+# 订单金额、距离随机池的大小，用完后整池重新抽样
+ORDER_POOL_SIZE = 256
+
+# 用餐时段：早餐7-9点、午餐11-13点、晚餐17-19点（左闭右开）
+MEAL_TIMES = ((7, 9), (11, 13), (17, 19))
+# 按小时索引的用餐时间表
+MEAL_HOURS = np.zeros(24, dtype=bool)
+for _start, _end in MEAL_TIMES:
+    MEAL_HOURS[_start:_end] = True
+del _start, _end
+
+class EnvState(NamedTuple):
+    """某一小时的环境状态快照，字段按位置存储；传入编译内核时在边界处拆成标量"""
+    day: int
+    hour: int
+    temperature: float
+    shelter_rate: float
+    rest_rate: float
+    is_meal_time: bool
+
 class Environment:
     """环境规则模拟器"""
     
-    def __init__(self):
+    def __init__(self, simulation_days: int = 1, seed=None):
+        # 环境中的所有随机性都来自同一个生成器，给定seed时结果可复现
+        self._rng = np.random.default_rng(seed)
+        self._cost_pool = np.empty(0)
+        self._distance_pool = np.empty(0)
+        self._pool_idx = 0
+        self._state_cache: Optional[EnvState] = None
         self.current_day = 0
         self.current_hour = 6  # 从早上6点开始
         self.shelter_rate = 0.15  # 初始阴凉覆盖率
         self.rest_rate = 0.6      # 休息区覆盖率
         self.tax_rate = 0.1       # 税率
-        self.temperature_curve = self._generate_temperature_curve()
+        # 仿真结束时会推进到第simulation_days天的0点，因此多生成一天
+        self.temperature_matrix = self._generate_temperature_matrix(simulation_days + 1)
         
-    def _generate_temperature_curve(self) -> List[float]:
-        """生成24小时温度曲线（极端高温场景）"""
+    def _generate_temperature_matrix(self, days: int) -> np.ndarray:
+        """一次生成days天的24小时温度曲线（极端高温场景），形状为(days, 24)"""
         hours = np.arange(24)
         # 基础温度曲线：夜间35度，白天最高45度
         base_temp = 35 + 10 * np.sin((hours - 6) * np.pi / 12)
-        # 添加随机波动
-        noise = np.random.normal(0, 2, 24)
-        temperatures = base_temp + noise
+        # 添加随机波动，在噪声数组上原地叠加和截断，不再分配中间数组
+        temps = self._rng.normal(0, 2, (days, 24))
+        temps += base_temp
         # 确保最低温度不低于32度，最高不超过48度
-        temperatures = np.clip(temperatures, 32, 48)
-        return temperatures.tolist()
+        return np.clip(temps, 32, 48, out=temps)
+    
+    @property
+    def temperature_curve(self) -> np.ndarray:
+        """当天24小时温度曲线"""
+        return self.temperature_matrix[self.current_day]
     
     def get_current_temperature(self) -> float:
         """获取当前温度"""
-        return self.temperature_curve[self.current_hour]
+        return float(self.temperature_matrix[self.current_day, self.current_hour])
+    
+    def draw_order(self) -> Tuple[float, float]:
+        """
+        生成一个订单的(金额, 距离)，两者取自预抽样池的同一位置。
+
+        金额在15-50元之间均匀分布，距离遵循Zipf分布并限制在1-10km；池用完时一次性重新抽样。
+        """
+        i = self._pool_idx
+        if i >= self._cost_pool.shape[0]:
+            self._cost_pool = self._rng.uniform(15, 50, ORDER_POOL_SIZE)
+            # 使用Zipf分布生成1-10km的距离
+            self._distance_pool = np.clip(self._rng.zipf(1.5, ORDER_POOL_SIZE), 1, 10).astype(float)
+            i = 0
+        self._pool_idx = i + 1
+        return float(self._cost_pool[i]), float(self._distance_pool[i])
     
     def get_order_distance(self) -> float:
-        """生成订单距离，遵循Zipf分布"""
-        # 使用Zipf分布生成1-10km的距离
-        zipf_sample = np.random.zipf(1.5)
-        distance = min(zipf_sample, 10)  # 限制最大距离为10km
-        return max(1, distance)  # 最小距离为1km
+        """生成订单距离，遵循Zipf分布，限制在1-10km；创建订单时用draw_order同时取金额和距离"""
+        return self.draw_order()[1]
     
     def get_order_cost(self) -> float:
-        """生成订单金额"""
-        return random.uniform(15, 50)
+        """生成订单金额；创建订单时用draw_order同时取金额和距离"""
+        return self.draw_order()[0]
     
     def is_meal_time(self) -> bool:
         """判断是否为用餐时间"""
-        meal_times = [
-            (7, 9),   # 早餐
-            (11, 13), # 午餐
-            (17, 19)  # 晚餐
-        ]
-        return any(start <= self.current_hour < end for start, end in meal_times)
+        return bool(MEAL_HOURS[self.current_hour])
     
     def advance_hour(self):
         """推进一小时"""
@@ -62,24 +99,40 @@ class Environment:
         if self.current_hour >= 24:
             self.current_hour = 0
             self.current_day += 1
-            # 每天重新生成温度曲线
-            self.temperature_curve = self._generate_temperature_curve()
+            # 超出预生成天数时按同样规则续生成
+            if self.current_day >= self.temperature_matrix.shape[0]:
+                extra = self._generate_temperature_matrix(self.temperature_matrix.shape[0])
+                self.temperature_matrix = np.vstack([self.temperature_matrix, extra])
     
     def add_shelter(self, increase_rate: float):
         """政府增设纳凉点"""
         self.shelter_rate = min(1.0, self.shelter_rate + increase_rate)
         print(f"Day {self.current_day}: 政府增设纳凉点，阴凉覆盖率提升至 {self.shelter_rate:.2f}")
     
-    def get_environment_state(self) -> Dict:
-        """获取环境状态"""
-        return {
-            "day": self.current_day,
-            "hour": self.current_hour,
-            "temperature": self.get_current_temperature(),
-            "shelter_rate": self.shelter_rate,
-            "rest_rate": self.rest_rate,
-            "is_meal_time": self.is_meal_time()
-        }
+    def get_environment_state(self, day: Optional[int] = None, hour: Optional[int] = None) -> EnvState:
+        """
+        获取环境状态。
+
+        给定day/hour时直接读取该时刻的状态，不读写环境时钟；省略时为当前时刻。
+        """
+        if day is None:
+            day = self.current_day
+        if hour is None:
+            hour = self.current_hour
+        # 同一小时内各Agent反复读取当前状态，时钟和政策参数不变时复用上一次的快照
+        cached = self._state_cache
+        if (cached is not None and cached.day == day and cached.hour == hour
+                and cached.shelter_rate == self.shelter_rate and cached.rest_rate == self.rest_rate):
+            return cached
+        self._state_cache = EnvState(
+            day,
+            hour,
+            float(self.temperature_matrix[day, hour]),
+            self.shelter_rate,
+            self.rest_rate,
+            bool(MEAL_HOURS[hour]),
+        )
+        return self._state_cache
     
     def plot_temperature_curve(self):
         """绘制当天温度曲线"""
@@ -0,0 +1,136 @@
+"""
+数值计算内核
+骑手决策与状态更新等纯算术逻辑，使用Numba编译加速；未安装Numba时按普通Python执行
+"""
+
+import os
+import numpy as np
+
+try:
+    import numba
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+    # LangGraph在工作线程中执行同步节点；部分TBB版本在非主线程启动过并行内核后
+    # 解释器退出时会挂起，因此优先使用OpenMP线程层（可用环境变量覆盖）
+    if "NUMBA_THREADING_LAYER_PRIORITY" not in os.environ:
+        numba.config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+except ImportError:  # Numba为可选依赖
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """未安装Numba时的替代装饰器，原样返回函数"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# 骑手行动编码
+ACTION_OFF_DUTY = 0
+ACTION_REST = 1
+ACTION_DELIVER = 2
+ACTION_COMPLAIN = 3
+
+# 健康损失系数
+HEALTH_LOSS_K = 0.2
+
+@njit(cache=True)
+def delivery_health_loss(temperature: float, distance: float, shelter_rate: float) -> float:
+    """配送一单的健康损失：35°C以上按温度、距离和未被阴凉覆盖的比例线性增加"""
+    return max(0.0, (temperature - 35) * HEALTH_LOSS_K * distance * (1 - shelter_rate))
+
+@njit(cache=True)
+def rest_recovery(temperature: float, rest_rate: float) -> float:
+    """休息一小时恢复的健康：按休息区覆盖率恢复，40°C以上恢复减半"""
+    return 0.5 * rest_rate if temperature > 40 else 1.0 * rest_rate
+
+@njit(cache=True)
+def rider_happiness(health: float, money: float, temperature: float) -> float:
+    """根据健康、资金和温度计算幸福感"""
+    health_factor = health / 10.0
+    money_factor = min(1.0, money / 2000.0)
+    temp_factor = max(0.1, 1.0 - (temperature - 30) / 20)
+    happiness = (health_factor * 0.4 + money_factor * 0.3 + temp_factor * 0.3) * 10
+    return max(0.0, min(10.0, happiness))
+
+@njit(parallel=True, fastmath=True, cache=True)
+def rule_rider_step(health, money, happiness, daily_income, orders_completed, on_duty,
+                    temperature, shelter_rate, rest_rate, uniforms, rider_order,
+                    order_order, distances, incomes):
+    """
+    规则决策模式下一小时内所有骑手的决策与状态更新（LLMRider的规则）。
+
+    决策优先级：离职 > 健康<2强制休息 > 投诉 > 高温休息 > 接单 > 休息。
+    骑手按rider_order的顺序决策，接单的骑手依次分得order_order中的下一个订单，
+    订单耗尽后后续骑手看到的可接订单数为0。随机数全部由调用方传入。
+
+    骑手之间只有订单分配存在先后依赖：先并行地按“有订单”判断每个骑手的意向，
+    再按rider_order顺序把订单分给前n_orders个想接单的骑手，其余改为休息
+    （订单耗尽后接单分支不成立，规则落到休息，结果与逐个决策相同），
+    最后并行更新各骑手状态。
+
+    Args:
+        uniforms: 形状为(骑手数, 3)的[0, 1)均匀随机数，依次用于投诉、高温休息和接单判断
+        rider_order: 骑手的决策顺序
+        order_order: 订单的分配顺序
+        distances: 每个可接订单的距离
+        incomes: 每个可接订单的骑手收入
+
+    Returns:
+        (actions, assigned, health_loss, recovery, deliveries, complaints, rests)：
+        行动编码数组、每个骑手分得的订单下标（未分得为-1）、健康损失数组、
+        休息骑手恢复的健康以及各行动的次数
+    """
+    n = health.shape[0]
+    n_orders = distances.shape[0]
+    actions = np.empty(n, dtype=np.int8)
+    assigned = np.full(n, -1, dtype=np.int64)
+    health_loss = np.zeros(n)
+    temp_factor = max(0.1, 1.0 - (temperature - 35) / 15)
+    recovery = rest_recovery(temperature, rest_rate)
+    
+    # 1. 并行决策
+    for i in prange(n):
+        h = health[i]
+        if not on_duty[i]:
+            actions[i] = ACTION_OFF_DUTY
+        elif h < 2:
+            actions[i] = ACTION_REST
+        elif h < 3 and uniforms[i, 0] < 0.3:
+            actions[i] = ACTION_COMPLAIN
+        elif temperature > 42 and h < 6 and uniforms[i, 1] < 0.7:
+            actions[i] = ACTION_REST
+        elif n_orders > 0 and h >= 3 and uniforms[i, 2] < h / 10.0 * temp_factor:
+            actions[i] = ACTION_DELIVER
+        else:
+            actions[i] = ACTION_REST
+    
+    # 2. 按决策顺序分配订单
+    next_order = 0
+    for k in range(n):
+        i = rider_order[k]
+        if actions[i] == ACTION_DELIVER:
+            if next_order < n_orders:
+                assigned[i] = order_order[next_order]
+                next_order += 1
+            else:
+                actions[i] = ACTION_REST
+    
+    # 3. 并行更新状态
+    for i in prange(n):
+        action = actions[i]
+        if action == ACTION_DELIVER:
+            j = assigned[i]
+            loss = delivery_health_loss(temperature, distances[j], shelter_rate)
+            health_loss[i] = loss
+            health[i] = max(0.0, health[i] - loss)
+            money[i] += incomes[j]
+            daily_income[i] += incomes[j]
+            orders_completed[i] += 1
+            happiness[i] = rider_happiness(health[i], money[i], temperature)
+        elif action == ACTION_REST:
+            health[i] = min(10.0, health[i] + recovery)
+    
+    deliveries = next_order
+    complaints = np.sum(actions == ACTION_COMPLAIN)
+    rests = np.sum(actions == ACTION_REST)
+    return actions, assigned, health_loss, recovery, deliveries, complaints, rests
@@ -3,302 +3,464 @@
 集成DeepSeek LLM进行智能决策
 """
 
-from typing import Dict, List, Any, TypedDict, Annotated, cast
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, TypedDict, Annotated, cast
 from langgraph.graph import StateGraph, END, START
 from langchain_core.runnables import RunnableConfig
-import random
+import os
+import sys
 import asyncio
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import matplotlib.pyplot as plt
 import pandas as pd
+import numpy as np
 
-from environment import Environment
-from llm_agents import LLMCustomer, LLMRider, LLMGovernment, LLMPlatform
-from utils import SimulationLogger
-from llm_config import check_llm_status
+from agents import OrderLedger
+from environment import EnvState, Environment
+from kernels import ACTION_COMPLAIN, ACTION_DELIVER, ACTION_OFF_DUTY, ACTION_REST
+from llm_agents import (CustomerArray, LLMCustomer, LLMGovernment, LLMPlatform, LLMRider,
+                        RiderArray)
+from utils import OrderArchive, SimulationLogger
+from llm_config import check_llm_status, deepseek_client
+
+# 同一小时内各Agent的LLM决策互不依赖，异步并发发出请求，这里限制同时进行的请求数
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "32"))
+# 每小时等待LLM决策的最长时间（秒），超时的Agent本小时视为决策失败
+LLM_DECISION_TIMEOUT = float(os.getenv("LLM_DECISION_TIMEOUT", "60"))
+# 每次LLM调用合并决策的同类Agent数，设为1时每个Agent单独调用
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "20"))
+# 仿真总小时数不超过该值时不经过LangGraph调度，按同样的节点和路由直接循环执行，设为0时总是使用LangGraph
+GRAPH_DIRECT_MAX_HOURS = int(os.getenv("GRAPH_DIRECT_MAX_HOURS", "256"))
+# 设为1时Agent行为日志每天以JSON Lines写入<output_prefix>_actions.jsonl后从内存释放，长仿真内存占用不随天数增长
+SIM_STREAM_LOGS = os.getenv("SIM_STREAM_LOGS", "0") != "0"
+# 默认输出级别，见LangGraphHeatWeatherSimulation的verbose参数
+SIM_VERBOSE = int(os.getenv("SIM_VERBOSE", "1"))
+
+# 仿真效果评估的分级：低于3为较差，[3, 5)一般，[5, 7)良好，7及以上优秀
+GRADE_THRESHOLDS = np.array([3, 5, 7])
+HEALTH_GRADES = ("较差 ❌", "一般 ⚠️", "良好 👍", "优秀 ✅")
+HAPPINESS_GRADES = ("较差 😟", "一般 😐", "良好 🙂", "优秀 😊")
+
+def _grade(value, labels):
+    """按GRADE_THRESHOLDS给出value的评级；value为数组时返回对应的评级列表，便于批量评估多次仿真"""
+    index = np.searchsorted(GRADE_THRESHOLDS, value, side="right")
+    if np.ndim(index) == 0:
+        return labels[int(index)]
+    return [labels[i] for i in index.tolist()]
 
 class LangGraphSimulationState(TypedDict):
-    """LangGraph仿真状态定义"""
+    """
+    LangGraph仿真状态定义
+
+    只保存路由需要的时钟与控制标志；环境、Agent和订单等对象由各节点原地修改，
+    放在SimulationContext中，不随状态在节点间传递
+    """
+    current_day: int
+    current_hour: int
+    
+    # 状态标志
+    simulation_running: bool
+    step_count: int
+
+@dataclass
+class SimulationContext:
+    """一次仿真中各节点共享的环境、Agent与订单数据"""
     # 环境和Agent
     environment: Environment
+    env_state: EnvState  # 当前小时的环境快照，由environment_step更新
     customers: List[LLMCustomer]
     riders: List[LLMRider]
+    customer_arrays: CustomerArray
+    rider_arrays: RiderArray
     platform: LLMPlatform
     government: LLMGovernment
-    
-    # 仿真控制
-    current_day: int
-    current_hour: int
     simulation_days: int
     
     # 数据记录
-    all_orders: List[Any]
-    current_orders: List[Any]
+    order_ledger: OrderLedger  # 全部订单数值字段的结构数组，供统计做向量化归约
+    orders_by_day: List[List[Any]]  # 按下单日期分桶的订单，当天结束归档后清空
+    order_archive: OrderArchive
+    unassigned_orders: Dict[str, Any]  # 当天尚未分配骑手的订单，按order_id索引
+    customers_by_id: Dict[str, LLMCustomer]
     logger: SimulationLogger
     
     # 决策模式
     decision_mode: str
-    
-    # 状态标志
-    simulation_running: bool
-    step_count: int
 
 class LangGraphHeatWeatherSimulation:
     """基于LangGraph的极端高温仿真系统"""
     
-    def __init__(self, num_customers: int = 5, num_riders: int = 2, simulation_days: int = 5, decision_mode: str = 'llm'):
+    def __init__(self, num_customers: int = 5, num_riders: int = 2, simulation_days: int = 5, decision_mode: str = 'llm',
+                 seed: Optional[int] = None, verbose: int = SIM_VERBOSE, output_prefix: Optional[str] = None):
         self.num_customers = num_customers
         self.num_riders = num_riders
         self.simulation_days = simulation_days
         self.decision_mode = decision_mode
+        # 输出级别：0只输出最终报告，1每天输出一次总结，2输出每小时每个Agent的行为
+        self.verbose = verbose
+        self._log_buf: List[str] = []
+        # 日志和订单归档文件名前缀，多次仿真同时运行时需各不相同
+        self.output_prefix = output_prefix or f"langgraph_simulation_{simulation_days}days"
         
         # 检查LLM状态
         if self.decision_mode == 'llm':
             check_llm_status()
         
-        # 初始化组件
-        self.environment = Environment()
-        self.customers = [LLMCustomer(f"customer_{i}") for i in range(num_customers)]
-        self.riders = [LLMRider(f"rider_{i}") for i in range(num_riders)]
+        # 初始化组件，环境和两个群体各用一个由seed派生的独立随机数流
+        env_seed, customer_seed, rider_seed = np.random.SeedSequence(seed).spawn(3)
+        self.environment = Environment(simulation_days, env_seed)
+        # 客户和骑手的数值状态按群体存放在结构数组中，Agent对象只是其中一行的视图
+        self.customer_arrays = CustomerArray.create(num_customers, customer_seed)
+        self.rider_arrays = RiderArray.create(num_riders, rider_seed)
+        self.customers = [LLMCustomer(f"customer_{i}", self.customer_arrays, i) for i in range(num_customers)]
+        self.riders = [LLMRider(f"rider_{i}", self.rider_arrays, i) for i in range(num_riders)]
         self.platform = LLMPlatform()
         self.government = LLMGovernment()
-        self.logger = SimulationLogger()
+        # 每小时每个Agent最多一条行为日志，另加平台和政府；流式写出时内存中最多保留一天
+        logged_days = 1 if SIM_STREAM_LOGS else simulation_days
+        self.logger = SimulationLogger(logged_days * 24 * (num_customers + num_riders + 2),
+                                       f"{self.output_prefix}_actions.jsonl" if SIM_STREAM_LOGS else None)
+        
+        self._llm_semaphore = asyncio.Semaphore(LLM_MAX_WORKERS)
+        # 节点共享的对象，每次run_simulation时创建
+        self._ctx: Optional[SimulationContext] = None
         
-        # 构建LangGraph
-        self.graph = self._build_simulation_graph()
+        # 构建LangGraph；编译（含拓扑校验）占构建耗时的大部分，且短仿真走_run_direct用不到，推迟到第一次使用时
+        self._workflow = self._build_simulation_graph()
+        self._graph = None
         
         print(f"🚀 LangGraph仿真系统初始化完成")
         print(f"📊 配置: {num_customers}个客户, {num_riders}个骑手, {simulation_days}天")
         print(f"🤖 决策模式: {'LLM智能决策' if self.decision_mode == 'llm' else '基于规则的决策'}")
         
-    def _build_simulation_graph(self):
-        """构建LangGraph仿真图"""
+    async def _bounded_decision(self, decision):
+        """限制并发数并为单个Agent的异步决策设置超时，超时视为本小时决策失败"""
+        async with self._llm_semaphore:
+            return await asyncio.wait_for(decision, LLM_DECISION_TIMEOUT)
+    
+    async def _gather_decisions(self, agents: List[Any], decide_one, decide_batch) -> List[Any]:
+        """
+        并发执行一组同类Agent的决策。
+
+        LLM_BATCH_SIZE>1时每批Agent合并为一次decide_batch调用，否则每个Agent单独调用decide_one。
+
+        Returns:
+            与agents一一对应的决策结果，决策失败的为异常对象
+        """
+        if LLM_BATCH_SIZE <= 1:
+            return await asyncio.gather(*(self._bounded_decision(decide_one(agent)) for agent in agents),
+                                        return_exceptions=True)
+        
+        batches = [agents[i:i + LLM_BATCH_SIZE] for i in range(0, len(agents), LLM_BATCH_SIZE)]
+        outcomes = await asyncio.gather(*(self._bounded_decision(decide_batch(batch)) for batch in batches),
+                                        return_exceptions=True)
+        results = []
+        for batch, outcome in zip(batches, outcomes):
+            results.extend([outcome] * len(batch) if isinstance(outcome, BaseException) else outcome)
+        return results
+    
+    def _log(self, message: str, *args):
+        """
+        记录逐小时的详细信息（verbose>=2）；传入args时message为str.format模板，只在确实输出时格式化。
+
+        信息先写入缓冲区，在每天开始时或仿真结束时由_flush_log一次性输出。
+        """
+        if self.verbose >= 2:
+            self._log_buf.append(message.format(*args) if args else message)
+    
+    def _flush_log(self):
+        """一次性输出缓冲的逐小时信息"""
+        if self._log_buf:
+            self._log_buf.append("")
+            sys.stdout.write("\n".join(self._log_buf))
+            sys.stdout.flush()
+            self._log_buf.clear()
+    
+    @property
+    def graph(self):
+        """编译后的LangGraph仿真图，第一次访问时编译"""
+        if self._graph is None:
+            self._graph = self._workflow.compile()
+        return self._graph
+    
+    def _build_simulation_graph(self) -> StateGraph:
+        """构建LangGraph仿真图（未编译），同时准备_run_direct使用的节点表"""
         
-        def environment_step(state: LangGraphSimulationState) -> LangGraphSimulationState:
+        def environment_step(state: LangGraphSimulationState) -> Dict[str, Any]:
             """环境推进步骤"""
-            env = state["environment"]
+            ctx = self._ctx
+            env = ctx.environment
             env.advance_hour()
+            if env.current_hour == 0:
+                # 天的边界，输出前一天缓冲的逐小时信息
+                self._flush_log()
             
-            state["current_day"] = env.current_day
-            state["current_hour"] = env.current_hour
-            state["step_count"] += 1
+            # 本小时的环境快照，后续节点共用同一份
+            ctx.env_state = env.get_environment_state(env.current_day, env.current_hour)
+            update = {
+                "current_day": env.current_day,
+                "current_hour": env.current_hour,
+                "step_count": state["step_count"] + 1
+            }
             
             # 检查仿真结束条件
-            if env.current_day >= state["simulation_days"]:
-                state["simulation_running"] = False
-                print(f"🏁 仿真完成: 总共{state['step_count']}步")
+            if env.current_day >= ctx.simulation_days:
+                update["simulation_running"] = False
+                print(f"🏁 仿真完成: 总共{update['step_count']}步")
             
-            return state
+            return update
         
-        def customer_workflow(state: LangGraphSimulationState) -> LangGraphSimulationState:
+        async def customer_workflow(state: LangGraphSimulationState) -> Dict[str, Any]:
             """客户工作流节点"""
-            environment = state["environment"]
-            env_state = environment.get_environment_state()
+            ctx = self._ctx
+            environment = ctx.environment
+            env_state = ctx.env_state
             
             # 只在用餐时间执行客户行为
-            if not env_state["is_meal_time"]:
-                return state
+            if not env_state.is_meal_time:
+                return {}
+            
+            self._log("🍽️ {:02d}:00 客户决策时间", state["current_hour"])
+            
+            if ctx.decision_mode == 'rule':
+                self._rule_customer_step(state, env_state)
+                return {}
             
-            print(f"🍽️ {state['current_hour']:02d}:00 客户决策时间")
+            # 所有客户并发决策，订单池等共享状态在全部决策返回后依次修改
+            customers = ctx.customers
+            decision_mode = ctx.decision_mode
+            results = await self._gather_decisions(
+                customers,
+                lambda customer: customer.aobserve_and_decide(environment, decision_mode),
+                lambda batch: LLMCustomer.abatch_decide(batch, environment, decision_mode)
+            )
             
-            for customer in state["customers"]:
+            log_rows = []
+            for customer, order in zip(customers, results):
                 try:
-                    order = customer.observe_and_decide(environment, decision_mode=state["decision_mode"])
+                    if isinstance(order, BaseException):
+                        raise order
                     if order:
-                        state["current_orders"].append(order)
-                        state["all_orders"].append(order)
-                        print(f"  📱 {customer.agent_id}: 下单 {order.cost:.0f}元")
+                        ctx.unassigned_orders[order.order_id] = order
+                        ctx.order_ledger.add(order, customer._index)
+                        ctx.orders_by_day[order.day].append(order)
+                        self._log("  📱 {}: 下单 {:.0f}元", customer.agent_id, order.cost)
                         
-                        # 记录到日志
-                        state["logger"].log_agent_action(
-                            state["current_day"], state["current_hour"], 
-                            "Customer", customer.agent_id,
-                            customer.observations[-1] if customer.observations else "",
-                            customer.thoughts[-1] if customer.thoughts else "",
-                            customer.actions[-1] if customer.actions else ""
-                        )
+                        # 记录到日志，本小时结束时一次写入
+                        log_rows.append((customer.agent_id, *customer.last_trace()))
                 except Exception as e:
-                    print(f"❌ 客户{customer.agent_id}决策失败: {e}")
+                    print(f"❌ 客户{customer.agent_id}决策失败: {e!r}")
             
-            return state
+            ctx.logger.log_agent_actions(state["current_day"], state["current_hour"], "Customer", log_rows)
+            return {}
         
-        def rider_workflow(state: LangGraphSimulationState) -> LangGraphSimulationState:
+        async def rider_workflow(state: LangGraphSimulationState) -> Dict[str, Any]:
             """骑手工作流节点"""
-            environment = state["environment"]
-            env_state = environment.get_environment_state()
-            # 修复：通过检查rider_id是否为None或空来判断订单是否可用
-            available_orders = [o for o in state["current_orders"] if not o.rider_id]
+            ctx = self._ctx
+            environment = ctx.environment
+            env_state = ctx.env_state
+            available_orders = list(ctx.unassigned_orders.values())
             
-            temp = env_state['temperature']
+            temp = env_state.temperature
             if temp > 42:
-                print(f"🔥 {state['current_hour']:02d}:00 极端高温警报! {temp:.1f}°C")
+                self._log("🔥 {:02d}:00 极端高温警报! {:.1f}°C", state["current_hour"], temp)
             elif temp > 38:
-                print(f"🌡️ {state['current_hour']:02d}:00 高温预警 {temp:.1f}°C")
+                self._log("🌡️ {:02d}:00 高温预警 {:.1f}°C", state["current_hour"], temp)
+            
+            if ctx.decision_mode == 'rule':
+                self._rule_rider_step(state, env_state, available_orders)
+                return {}
             
             # Shuffle riders to prevent bias and ensure fair order distribution
-            shuffled_riders = random.sample(state["riders"], len(state["riders"]))
+            riders = ctx.riders
+            shuffled_riders = [riders[i] for i in ctx.rider_arrays.rng.permutation(len(riders)) if riders[i].on_duty]
+            
+            # 所有骑手基于本小时开始时的可接订单并发决策，再按随机顺序依次执行
+            decision_mode = ctx.decision_mode
+            order_count = len(available_orders)
+            results = await self._gather_decisions(
+                shuffled_riders,
+                lambda rider: rider.aobserve_and_decide(environment, order_count, decision_mode),
+                lambda batch: LLMRider.abatch_decide(batch, environment, order_count, decision_mode)
+            )
+            
+            # 骑手优先接距离最近的订单；distances与available_orders一一对应
+            distances = np.fromiter((o.distance for o in available_orders), dtype=np.float64, count=len(available_orders))
 
             # 处理每个骑手的决策
-            for rider in shuffled_riders:
-                if not rider.on_duty:
-                    continue
-                
+            log_rows = []
+            for rider, action in zip(shuffled_riders, results):
                 try:
-                    # For each rider, get the most up-to-date list of available orders
-                    # 修复：通过检查rider_id是否为None或空来判断订单是否可用
-                    available_orders = [o for o in state["current_orders"] if not o.rider_id]
-                    
-                    action = rider.observe_and_decide(environment, available_orders, decision_mode=state["decision_mode"])
+                    if isinstance(action, BaseException):
+                        raise action
                     
                     if action == "deliver" and available_orders:
-                        # 选择并配送订单
-                        order = random.choice(available_orders)
+                        # 选择最近的订单，与末尾元素交换后弹出，保持可接订单列表为最新
+                        last = len(available_orders) - 1
+                        j = int(np.argmin(distances[:last + 1]))
+                        distances[j] = distances[last]
+                        available_orders[j], available_orders[last] = available_orders[last], available_orders[j]
+                        order = available_orders.pop()
+                        del ctx.unassigned_orders[order.order_id]
                         result = rider.deliver_order(order, environment)
-                        
-                        # 移除此行：不再从当前订单池中物理删除订单
-                        # 而是依赖 order.rider_id 属性来识别已分配的订单
-                        # state["current_orders"].remove(order)
+                        ctx.order_ledger.mark_delivered(order, rider._index)
                         
                         # 客户评分和小费
-                        customer = next(c for c in state["customers"] if c.agent_id == order.customer_id)
+                        customer = ctx.customers_by_id[order.customer_id]
                         rating = customer.rate_order(order, rider.health)
                         tip = customer.decide_tip(order, rider.health)
                         
-                        print(f"  🚴 {rider.agent_id}: 配送完成 +{result['income']:.0f}元 健康{rider.health:.1f}/10")
+                        self._log("  🚴 {}: 配送完成 +{:.0f}元 健康{:.1f}/10", rider.agent_id, result["income"], rider.health)
                         
                         # 健康警报
                         if rider.health < 3:
-                            print(f"    ⚠️ {rider.agent_id} 健康状况危险!")
+                            self._log("    ⚠️ {} 健康状况危险!", rider.agent_id)
                         elif rider.health < 5:
-                            print(f"    💔 {rider.agent_id} 健康状况较差")
+                            self._log("    💔 {} 健康状况较差", rider.agent_id)
+                    
+                    elif action == "deliver":
+                        # 订单已被先执行的骑手接完，与规则模式（kernels.rule_rider_step）一样改为休息
+                        rider.rest(environment)
+                        self._log("  💤 {}: 无单可接，休息恢复", rider.agent_id)
                             
                     elif action == "rest":
                         rider.rest(environment)
-                        print(f"  💤 {rider.agent_id}: 休息恢复")
+                        self._log("  💤 {}: 休息恢复", rider.agent_id)
                         
                     elif action == "complain":
                         complaint = rider.complain(environment)
-                        print(f"  📢 {rider.agent_id}: 投诉工作条件")
+                        self._log("  📢 {}: 投诉工作条件", rider.agent_id)
                     
-                    # 记录到日志
-                    state["logger"].log_agent_action(
-                        state["current_day"], state["current_hour"],
-                        "Rider", rider.agent_id,
-                        rider.observations[-1] if rider.observations else "",
-                        rider.thoughts[-1] if rider.thoughts else "",
-                        rider.actions[-1] if rider.actions else ""
-                    )
+                    # 记录到日志，本小时结束时一次写入
+                    log_rows.append((rider.agent_id, *rider.last_trace()))
                     
                 except Exception as e:
-                    print(f"❌ 骑手{rider.agent_id}决策失败: {e}")
+                    print(f"❌ 骑手{rider.agent_id}决策失败: {e!r}")
             
-            return state
+            ctx.logger.log_agent_actions(state["current_day"], state["current_hour"], "Rider", log_rows)
+            return {}
         
-        def platform_workflow(state: LangGraphSimulationState) -> LangGraphSimulationState:
+        async def platform_workflow(state: LangGraphSimulationState) -> Dict[str, Any]:
             """平台工作流节点"""
+            ctx = self._ctx
             # 只在每天结束时执行平台决策
             if state["current_hour"] != 23:
-                return state
+                return {}
             
-            print(f"💼 平台运营决策")
+            self._log("💼 平台运营决策")
             
             try:
-                platform = state["platform"]
-                actions = platform.observe_and_decide(state["riders"], state["all_orders"], decision_mode=state["decision_mode"])
+                platform = ctx.platform
+                today_orders = ctx.orders_by_day[state["current_day"]]
+                actions = await self._bounded_decision(
+                    platform.aobserve_and_decide(ctx.riders, today_orders, decision_mode=ctx.decision_mode))
                 
                 # 计算日收益
-                profit = platform.calc_profit(state["all_orders"])
-                print(f"  💰 日收益: {profit:.0f}元")
+                profit = platform.calc_profit(ctx.order_ledger, state["current_day"])
+                self._log("  💰 日收益: {:.0f}元", profit)
                 
                 # 缴税
                 if state["current_day"] % 7 == 0:  # 每周缴税
-                    tax = platform.pay_tax(state["government"])
-                    print(f"  💸 缴税: {tax:.0f}元")
+                    tax = platform.pay_tax(ctx.government)
+                    self._log("  💸 缴税: {:.0f}元", tax)
                 
                 # 记录到日志
-                state["logger"].log_agent_action(
+                ctx.logger.log_agent_action(
                     state["current_day"], state["current_hour"],
                     "Platform", platform.agent_id,
-                    platform.observations[-1] if platform.observations else "",
-                    platform.thoughts[-1] if platform.thoughts else "",
-                    platform.actions[-1] if platform.actions else ""
+                    *platform.last_trace()
                 )
                 
             except Exception as e:
                 print(f"❌ 平台决策失败: {e}")
             
-            return state
+            return {}
         
-        def government_workflow(state: LangGraphSimulationState) -> LangGraphSimulationState:
+        async def government_workflow(state: LangGraphSimulationState) -> Dict[str, Any]:
             """政府工作流节点"""
+            ctx = self._ctx
             # 只在每天晚上22点执行政府决策
             if state["current_hour"] != 22:
-                return state
+                return {}
             
-            print(f"🏛️ 政府政策决策")
+            self._log("🏛️ 政府政策决策")
             
             try:
-                government = state["government"]
-                environment = state["environment"]
-                policies = government.observe_and_decide(environment, state["riders"], decision_mode=state["decision_mode"])
+                government = ctx.government
+                environment = ctx.environment
+                policies = await self._bounded_decision(
+                    government.aobserve_and_decide(environment, ctx.riders, decision_mode=ctx.decision_mode))
                 
                 # 执行政策
                 if policies["subsidy"] > 0:
-                    print(f"  🎁 发放高温补贴: {policies['subsidy']:.0f}元")
+                    self._log("  🎁 发放高温补贴: {:.0f}元", policies["subsidy"])
                 
                 if policies["shelter"]:
                     # 增加纳凉点覆盖率
-                    state["environment"].add_shelter(0.1)
-                    print(f"  🏠 增设纳凉点，覆盖率提升至{state['environment'].shelter_rate:.2f}")
+                    ctx.environment.add_shelter(0.1)
+                    self._log("  🏠 增设纳凉点，覆盖率提升至{:.2f}", ctx.environment.shelter_rate)
                 
                 # 记录到日志
-                state["logger"].log_agent_action(
+                ctx.logger.log_agent_action(
                     state["current_day"], state["current_hour"],
                     "Government", government.agent_id,
-                    government.observations[-1] if government.observations else "",
-                    government.thoughts[-1] if government.thoughts else "",
-                    government.actions[-1] if government.actions else ""
+                    *government.last_trace()
                 )
                 
             except Exception as e:
                 print(f"❌ 政府决策失败: {e}")
             
-            return state
+            return {}
         
-        def daily_summary(state: LangGraphSimulationState) -> LangGraphSimulationState:
+        def daily_summary(state: LangGraphSimulationState) -> Dict[str, Any]:
             """每日总结节点"""
+            ctx = self._ctx
             # 在新的一天开始时总结前一天
             if state["current_hour"] == 0 and state["current_day"] > 0:
                 prev_day = state["current_day"] - 1
-                print(f"\n📊 Day {prev_day + 1} 总结")
                 
                 # 记录每日统计
-                state["logger"].log_daily_stats(
-                    prev_day, state["riders"], state["customers"],
-                    state["all_orders"], state["environment"].get_environment_state(),
-                    state["government"], state["platform"]
+                ctx.logger.log_daily_stats(
+                    prev_day, ctx.riders, ctx.customers,
+                    len(ctx.order_ledger), ctx.order_ledger.delivered_count(),
+                    ctx.env_state,
+                    ctx.government, ctx.platform,
+                    rider_arrays=ctx.rider_arrays
                 )
                 
+                # 前一天的订单已不会再变化，写入归档后释放；行为日志同样按天写出
+                ctx.order_archive.append(ctx.orders_by_day[prev_day])
+                ctx.orders_by_day[prev_day] = []
+                ctx.logger.flush_stream()
+                
                 # 打印简要统计
-                completed_orders = len([o for o in state["all_orders"] if hasattr(o, 'delivered') and o.delivered])
-                avg_health = sum(r.health for r in state["riders"]) / len(state["riders"])
-                total_complaints = sum(len(r.complaints) for r in state["riders"])
+                completed_orders = ctx.order_ledger.delivered_count()
+                rider_arrays = ctx.rider_arrays
+                avg_health = float(rider_arrays.health.mean())
+                total_complaints = int(rider_arrays.complaint_count.sum())
                 
-                print(f"  📦 完成订单: {completed_orders}")
-                print(f"  🏥 骑手平均健康: {avg_health:.1f}/10")
-                print(f"  📢 总投诉数: {total_complaints}")
-                print(f"  🏛️ 政府补贴: {state['government'].subsidies_paid:.0f}元")
-                print(f"  🏠 纳凉点覆盖率: {state['environment'].shelter_rate:.2f}")
+                if self.verbose >= 1:
+                    # 汇总为一次写出
+                    sys.stdout.write("\n".join([
+                        f"\n📊 Day {prev_day + 1} 总结",
+                        f"  📦 完成订单: {completed_orders}",
+                        f"  🏥 骑手平均健康: {avg_health:.1f}/10",
+                        f"  📢 总投诉数: {total_complaints}",
+                        f"  🏛️ 政府补贴: {ctx.government.subsidies_paid:.0f}元",
+                        f"  🏠 纳凉点覆盖率: {ctx.environment.shelter_rate:.2f}",
+                    ]) + "\n")
                 
                 # 重置日统计
-                state["platform"].daily_revenue = 0.0
-                for rider in state["riders"]:
-                    rider.daily_income = 0.0
+                ctx.platform.daily_revenue = 0.0
+                rider_arrays.daily_income[:] = 0.0
                 
                 # 为新的一天清空当前订单池
-                state["current_orders"] = []
+                ctx.unassigned_orders = {}
             
-            return state
+            return {}
         
         def check_continuation(state: LangGraphSimulationState) -> str:
             """检查是否继续仿真"""
@@ -307,6 +469,22 @@ class LangGraphHeatWeatherSimulation:
             else:
                 return "end"
         
+        # 以下路由跳过本小时不会执行任何操作的节点，各节点内部仍保留自己的时间判断
+        def route_after_environment(state: LangGraphSimulationState) -> str:
+            if state["current_hour"] == 0 and state["current_day"] > 0:
+                return "daily_summary"
+            return route_after_summary(state)
+        
+        def route_after_summary(state: LangGraphSimulationState) -> str:
+            return "customer_workflow" if self._ctx.env_state.is_meal_time else "rider_workflow"
+        
+        def route_after_rider(state: LangGraphSimulationState) -> str:
+            if state["current_hour"] == 23:
+                return "platform_workflow"
+            if state["current_hour"] == 22:
+                return "government_workflow"
+            return check_continuation(state)
+        
         # 构建图
         workflow = StateGraph(LangGraphSimulationState)
         
@@ -321,24 +499,162 @@ class LangGraphHeatWeatherSimulation:
         # 设置入口点
         workflow.add_edge(START, "environment_step")
         
-        # 添加边（执行顺序）
-        workflow.add_edge("environment_step", "daily_summary")
-        workflow.add_edge("daily_summary", "customer_workflow")
+        # 添加边（执行顺序）：环境 -> [每日总结] -> [客户] -> 骑手 -> [平台/政府]
+        workflow.add_conditional_edges(
+            "environment_step",
+            route_after_environment,
+            ["daily_summary", "customer_workflow", "rider_workflow"]
+        )
+        workflow.add_conditional_edges(
+            "daily_summary",
+            route_after_summary,
+            ["customer_workflow", "rider_workflow"]
+        )
         workflow.add_edge("customer_workflow", "rider_workflow")
-        workflow.add_edge("rider_workflow", "platform_workflow")
-        workflow.add_edge("platform_workflow", "government_workflow")
         
         # 条件边：检查是否继续
+        continuation = {
+            "continue": "environment_step",
+            "end": END
+        }
         workflow.add_conditional_edges(
-            "government_workflow",
-            check_continuation,
-            {
-                "continue": "environment_step",
-                "end": END
-            }
+            "rider_workflow",
+            route_after_rider,
+            {**continuation, "platform_workflow": "platform_workflow", "government_workflow": "government_workflow"}
         )
+        workflow.add_conditional_edges("platform_workflow", check_continuation, continuation)
+        workflow.add_conditional_edges("government_workflow", check_continuation, continuation)
+        
+        # 与上面的图相同的节点和路由，供_run_direct使用
+        self._direct_nodes = {
+            "environment_step": (environment_step, route_after_environment),
+            "daily_summary": (daily_summary, route_after_summary),
+            "customer_workflow": (customer_workflow, lambda state: "rider_workflow"),
+            "rider_workflow": (rider_workflow, route_after_rider),
+            "platform_workflow": (platform_workflow, check_continuation),
+            "government_workflow": (government_workflow, check_continuation),
+        }
+        self._direct_continuation = continuation
         
-        return workflow.compile()
+        return workflow
+    
+    async def _run_direct(self, state: LangGraphSimulationState) -> LangGraphSimulationState:
+        """
+        不经过LangGraph调度，按图的节点和路由直接循环执行。
+
+        节点本身只需微秒级，短仿真中图调度的开销占主要部分；结果与graph.ainvoke相同。
+        """
+        # 循环每小时执行数次，预先取出属性与方法
+        nodes = self._direct_nodes
+        continuation = self._direct_continuation.get
+        iscoroutine = asyncio.iscoroutine
+        update_state = state.update
+        node = "environment_step"
+        while node != END:
+            func, route = nodes[node]
+            update = func(state)
+            if iscoroutine(update):
+                update = await update
+            update_state(update)
+            node = route(state)
+            node = continuation(node, node)
+        return state
+    
+    def _rule_customer_step(self, state: LangGraphSimulationState, env_state: EnvState):
+        """规则决策模式下的客户步骤：一次向量运算决定所有客户是否下单"""
+        ctx = self._ctx
+        environment = ctx.environment
+        customers = ctx.customers
+        temp = env_state.temperature
+        hour = env_state.hour
+        
+        eligible, ordering = ctx.customer_arrays.rule_order_mask(temp, hour)
+        avg_ratings = ctx.customer_arrays.avg_ratings()
+        unassigned_orders = ctx.unassigned_orders
+        add_to_ledger = ctx.order_ledger.add
+        orders_by_day = ctx.orders_by_day
+        
+        log_rows = []
+        for i in np.flatnonzero(eligible):
+            customer = customers[i]
+            customer._observe(temp, hour, True, avg_ratings[i])
+            customer.add_thought("规则决策：基于温度、用餐时间和历史评分决定是否下单")
+            if not ordering[i]:
+                customer.add_action("未下单")
+                continue
+            
+            order = customer.place_order(environment, hour)
+            unassigned_orders[order.order_id] = order
+            add_to_ledger(order, i)
+            orders_by_day[order.day].append(order)
+            self._log("  📱 {}: 下单 {:.0f}元", customer.agent_id, order.cost)
+            log_rows.append((customer.agent_id, *customer.last_trace()))
+        
+        ctx.logger.log_agent_actions(state["current_day"], state["current_hour"], "Customer", log_rows)
+    
+    def _rule_rider_step(self, state: LangGraphSimulationState, env_state: EnvState, available_orders: List[Any]):
+        """
+        规则决策模式下的骑手步骤。
+
+        所有骑手的决策与状态更新在RiderArray上由编译内核一次完成，
+        这里只负责订单归属、客户评分、轨迹与日志等Python对象层面的工作。
+        """
+        ctx = self._ctx
+        customers_by_id = ctx.customers_by_id
+        riders = ctx.riders
+        arrays = ctx.rider_arrays
+        temp = env_state.temperature
+        shelter_rate = env_state.shelter_rate
+        rest_rate = env_state.rest_rate
+        order_count = len(available_orders)
+        
+        # 观察和决定记录的是更新前的健康状况
+        health_before = arrays.health.copy()
+        distances = np.array([o.distance for o in available_orders], dtype=float)
+        incomes = np.array([o.cost * 0.2 + o.tip for o in available_orders], dtype=float)
+        actions, assigned, health_loss, recovery = arrays.step_rule(temp, shelter_rate, rest_rate, distances, incomes)
+        unassigned_orders = ctx.unassigned_orders
+        mark_delivered = ctx.order_ledger.mark_delivered
+        
+        log_rows = []
+        for i in np.flatnonzero(actions != ACTION_OFF_DUTY):
+            rider = riders[i]
+            rider._observe(temp, shelter_rate, order_count, health_before[i])
+            if health_before[i] < 2:
+                rider.add_action("健康状况危险，强制休息")
+            else:
+                rider.add_thought("规则决策：基于健康、温度和订单数决定行动")
+            
+            action = actions[i]
+            if action == ACTION_DELIVER:
+                order = available_orders[assigned[i]]
+                del unassigned_orders[order.order_id]
+                order.rider_id = rider.agent_id
+                order.delivered = True
+                mark_delivered(order, i)
+                rider.record_delivery(order, incomes[assigned[i]], health_loss[i])
+                self._log("  🚴 {}: 配送完成 +{:.0f}元 健康{:.1f}/10", rider.agent_id, incomes[assigned[i]], rider.health)
+            elif action == ACTION_REST:
+                rider.record_rest(recovery)
+                self._log("  💤 {}: 休息恢复", rider.agent_id)
+            elif action == ACTION_COMPLAIN:
+                rider.complain(ctx.environment)
+                self._log("  📢 {}: 投诉工作条件", rider.agent_id)
+            
+            log_rows.append((rider.agent_id, *rider.last_trace()))
+        
+        # 客户按配送后骑手的健康一次为本小时送达的订单评分和定小费
+        delivering = np.flatnonzero(actions == ACTION_DELIVER)
+        if delivering.size:
+            delivered = [available_orders[j] for j in assigned[delivering]]
+            delivered_customers = [customers_by_id[order.customer_id] for order in delivered]
+            ratings, tips = ctx.customer_arrays.settle_orders(
+                np.array([customer._index for customer in delivered_customers]), arrays.health[delivering])
+            for order, customer, rating, tip in zip(delivered, delivered_customers, ratings.tolist(), tips.tolist()):
+                customer._record_rating(order, rating)
+                customer._record_tip(order, tip)
+        
+        ctx.logger.log_agent_actions(state["current_day"], state["current_hour"], "Rider", log_rows)
     
     async def run_simulation(self) -> Dict[str, Any]:
         """运行仿真"""
@@ -347,20 +663,31 @@ class LangGraphHeatWeatherSimulation:
         print("🤖 集成DeepSeek LLM智能决策")
         print("="*60)
         
-        # 初始状态
-        initial_state = LangGraphSimulationState(
+        # 节点共享的对象
+        self._ctx = SimulationContext(
             environment=self.environment,
+            env_state=self.environment.get_environment_state(),
             customers=self.customers,
             riders=self.riders,
+            customer_arrays=self.customer_arrays,
+            rider_arrays=self.rider_arrays,
             platform=self.platform,
             government=self.government,
-            current_day=0,
-            current_hour=6,  # 从早上6点开始
             simulation_days=self.simulation_days,
-            all_orders=[],
-            current_orders=[],
+            order_ledger=OrderLedger(),
+            order_archive=OrderArchive(f"{self.output_prefix}_orders.bin"),
+            # 仿真结束时会推进到第simulation_days天的0点，因此多留一天
+            orders_by_day=[[] for _ in range(self.simulation_days + 1)],
+            unassigned_orders={},
+            customers_by_id={c.agent_id: c for c in self.customers},
             logger=self.logger,
-            decision_mode=self.decision_mode,
+            decision_mode=self.decision_mode
+        )
+        
+        # 初始状态
+        initial_state = LangGraphSimulationState(
+            current_day=0,
+            current_hour=6,  # 从早上6点开始
             simulation_running=True,
             step_count=0
         )
@@ -368,47 +695,57 @@ class LangGraphHeatWeatherSimulation:
         try:
             # 运行LangGraph
             print(f"🚀 开始仿真...")
-            # 增加递归限制以支持长时间仿真
-            config = cast(RunnableConfig, {"recursion_limit": self.simulation_days * 24 + 100})
-            final_state = await self.graph.ainvoke(initial_state, config=config)
+            if self.simulation_days * 24 <= GRAPH_DIRECT_MAX_HOURS:
+                await self._run_direct(initial_state)
+            else:
+                # 增加递归限制以支持长时间仿真：每小时最多经过4个节点
+                config = cast(RunnableConfig, {"recursion_limit": self.simulation_days * 24 * 4 + 100})
+                await self.graph.ainvoke(initial_state, config=config)
+            self._flush_log()
             
             print("\n🎉 仿真完成!")
             
             # 生成最终报告
-            self._generate_final_report(final_state)
+            self._generate_final_report()
             
-            return self._extract_results(final_state)
+            return self._extract_results()
             
         except Exception as e:
+            self._flush_log()
             print(f"\n❌ 仿真失败: {e}")
             import traceback
             traceback.print_exc()
             return {}
+        finally:
+            # 异步客户端的连接池绑定在本次运行的事件循环上，循环结束前关闭，避免重复运行时泄漏连接
+            await deepseek_client.aclose()
     
-    def _generate_final_report(self, final_state: Dict[str, Any]):
+    def _generate_final_report(self):
         """生成最终报告"""
+        ctx = self._ctx
         print("\n" + "="*60)
         print("📈 最终仿真报告")
         print("="*60)
         
         # 保存详细日志
-        log_filename = f"langgraph_simulation_{self.simulation_days}days.json"
+        log_filename = f"{self.output_prefix}.json"
         self.logger.save_logs(log_filename)
         
         # 基础统计
-        riders = final_state["riders"]
-        orders = final_state["all_orders"]
-        government = final_state["government"]
-        platform = final_state["platform"]
+        riders = ctx.riders
+        government = ctx.government
+        platform = ctx.platform
         
-        total_orders = len(orders)
-        completed_orders = len([o for o in orders if hasattr(o, 'delivered') and o.delivered])
-        completion_rate = completed_orders / max(1, total_orders)
+        ledger = ctx.order_ledger
+        total_orders = len(ledger)
+        completed_orders = ledger.delivered_count()
+        completion_rate = ledger.completion_rate()
         
-        avg_health = sum(r.health for r in riders) / len(riders)
-        avg_happiness = sum(r.happiness for r in riders) / len(riders)
-        total_complaints = sum(len(r.complaints) for r in riders)
-        active_riders = len([r for r in riders if r.on_duty])
+        rider_arrays = ctx.rider_arrays
+        avg_health = float(rider_arrays.health.mean())
+        avg_happiness = float(rider_arrays.happiness.mean())
+        total_complaints = int(rider_arrays.complaint_count.sum())
+        active_riders = int(rider_arrays.on_duty.sum())
         
         print(f"📊 基础统计:")
         print(f"  - 仿真天数: {self.simulation_days}")
@@ -425,7 +762,7 @@ class LangGraphHeatWeatherSimulation:
         print(f"\n🏛️ 政府措施效果:")
         print(f"  - 总补贴支出: {government.subsidies_paid:.0f}元")
         print(f"  - 新建纳凉点: {government.shelters_built}个")
-        print(f"  - 最终覆盖率: {final_state['environment'].shelter_rate:.2f}")
+        print(f"  - 最终覆盖率: {ctx.environment.shelter_rate:.2f}")
         
         print(f"\n💰 平台运营:")
         print(f"  - 平台总资金: {platform.cash:.0f}元")
@@ -436,9 +773,8 @@ class LangGraphHeatWeatherSimulation:
         
         for agent_list in [riders, self.customers, [government, platform]]:
             for agent in agent_list:
-                if hasattr(agent, 'thoughts'):
-                    llm_decisions += len([t for t in agent.thoughts if "LLM" in t])
-                    rule_decisions += len([t for t in agent.thoughts if "规则" in t])
+                llm_decisions += agent.llm_thought_count
+                rule_decisions += agent.rule_thought_count
         
         print(f"\n🤖 决策方式统计:")
         print(f"  - LLM智能决策: {llm_decisions}次")
@@ -447,25 +783,8 @@ class LangGraphHeatWeatherSimulation:
         # 效果评估
         print(f"\n🎯 仿真效果评估:")
         
-        if avg_health >= 7:
-            health_grade = "优秀 ✅"
-        elif avg_health >= 5:
-            health_grade = "良好 👍"
-        elif avg_health >= 3:
-            health_grade = "一般 ⚠️"
-        else:
-            health_grade = "较差 ❌"
-        print(f"  - 健康水平: {health_grade}")
-        
-        if avg_happiness >= 7:
-            happiness_grade = "优秀 😊"
-        elif avg_happiness >= 5:
-            happiness_grade = "良好 🙂"
-        elif avg_happiness >= 3:
-            happiness_grade = "一般 😐"
-        else:
-            happiness_grade = "较差 😟"
-        print(f"  - 幸福感: {happiness_grade}")
+        print(f"  - 健康水平: {_grade(avg_health, HEALTH_GRADES)}")
+        print(f"  - 幸福感: {_grade(avg_happiness, HAPPINESS_GRADES)}")
         
         # 建议
         print(f"\n💡 AI分析与建议:")
@@ -475,7 +794,7 @@ class LangGraphHeatWeatherSimulation:
             print("  📌 投诉过多，需要改善工作环境")
         if completion_rate < 0.8:
             print("  📌 服务完成率偏低，需平衡效率与健康")
-        if final_state['environment'].shelter_rate < 0.5:
+        if ctx.environment.shelter_rate < 0.5:
             print("  📌 纳凉点覆盖率仍需提升")
         if active_riders < self.num_riders * 0.8:
             print("  📌 骑手流失严重，需改善待遇")
@@ -492,25 +811,70 @@ class LangGraphHeatWeatherSimulation:
         # except Exception as e:
         #     print(f"⚠️ 图表生成失败: {e}")
     
-    def _extract_results(self, final_state: Dict[str, Any]) -> Dict[str, Any]:
+    def _extract_results(self) -> Dict[str, Any]:
         """提取仿真结果"""
-        riders = final_state["riders"]
-        orders = final_state["all_orders"]
+        ctx = self._ctx
+        rider_arrays = ctx.rider_arrays
+        ledger = ctx.order_ledger
         
         return {
             "simulation_days": self.simulation_days,
-            "total_orders": len(orders),
-            "completed_orders": len([o for o in orders if hasattr(o, 'delivered') and o.delivered]),
-            "completion_rate": len([o for o in orders if hasattr(o, 'delivered') and o.delivered]) / max(1, len(orders)),
-            "avg_health": sum(r.health for r in riders) / len(riders),
-            "avg_happiness": sum(r.happiness for r in riders) / len(riders),
-            "total_complaints": sum(len(r.complaints) for r in riders),
-            "subsidies_paid": final_state["government"].subsidies_paid,
-            "shelters_built": final_state["government"].shelters_built,
-            "final_shelter_rate": final_state["environment"].shelter_rate,
-            "platform_cash": final_state["platform"].cash
+            "total_orders": len(ledger),
+            "completed_orders": ledger.delivered_count(),
+            "completion_rate": ledger.completion_rate(),
+            "avg_health": float(rider_arrays.health.mean()),
+            "avg_happiness": float(rider_arrays.happiness.mean()),
+            "total_complaints": int(rider_arrays.complaint_count.sum()),
+            "subsidies_paid": ctx.government.subsidies_paid,
+            "shelters_built": ctx.government.shelters_built,
+            "final_shelter_rate": ctx.environment.shelter_rate,
+            "platform_cash": ctx.platform.cash
         }
 
+def _run_replication(args) -> Dict[str, Any]:
+    """在子进程中以给定种子运行一次完整仿真，返回结果字典"""
+    seed, config = args
+    # 默认静默运行并按种子命名输出，调用方传入的verbose、output_prefix优先
+    kwargs = {
+        "verbose": 0,
+        "output_prefix": f"langgraph_simulation_{config.get('simulation_days', 5)}days_seed{seed}",
+        **config,
+    }
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            simulation = LangGraphHeatWeatherSimulation(seed=seed, **kwargs)
+            results = asyncio.run(simulation.run_simulation())
+    except Exception as e:
+        # 单次仿真失败只影响这一行结果，不中断整批重复实验
+        print(f"❌ 种子{seed}的仿真失败: {e!r}", file=sys.stderr)
+        results = {}
+    return {"seed": seed, **results}
+
+def run_replications(n_reps: int, seed_base: int = 0, max_workers: Optional[int] = None,
+                     **config) -> pd.DataFrame:
+    """
+    以种子seed_base, seed_base+1, ...并行运行n_reps次相互独立的仿真，用于政策评估的蒙特卡洛重复实验。
+
+    每次仿真在单独的进程中运行（spawn方式启动，调用方需放在 if __name__ == "__main__" 下），
+    默认verbose=0，日志和订单归档按种子分别命名；在config中指定verbose或output_prefix时以其为准
+    （指定output_prefix时各次仿真写同一组文件）。
+
+    Args:
+        n_reps: 重复次数
+        seed_base: 第一次仿真的种子
+        max_workers: 进程数，默认为CPU核数
+        **config: 传给LangGraphHeatWeatherSimulation的参数，如num_customers、simulation_days、decision_mode
+
+    Returns:
+        每次仿真一行的结果表，失败的仿真只有seed列
+    """
+    config.setdefault("decision_mode", "rule")
+    jobs = [(seed_base + i, config) for i in range(n_reps)]
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = list(executor.map(_run_replication, jobs))
+    return pd.DataFrame(results)
+
 def main():
     """主函数"""
     print("🤖 基于LangGraph和DeepSeek LLM的极端高温仿真系统")
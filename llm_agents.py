@@ -4,30 +4,343 @@
 """
 
 from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
-from collections import deque
-import random
-import uuid
+from dataclasses import dataclass, field
+import re
 import numpy as np
 
-from agents import AgentState, Order  # 导入原有基础类
-from llm_config import LLMEnhancedAgent, agent_prompts, deepseek_client
+from agents import AgentState, Order, OrderLedger, next_order_id  # 导入原有基础类
+from llm_config import (LLM_DIRECT_DECISIONS, LLMEnhancedAgent, agent_prompts, allm_decide_batch,
+                        deepseek_client)
 from environment import Environment
+from kernels import delivery_health_loss, rest_recovery, rider_happiness, rule_rider_step
+
+def _array_field(name: str, cast):
+    """把Agent属性映射到群体结构数组中的对应元素"""
+    def fget(self):
+        return cast(getattr(self._state, name)[self._index])
+    
+    def fset(self, value):
+        getattr(self._state, name)[self._index] = value
+    
+    return property(fget, fset)
+
+# 从LLM推理文本中识别意图的关键词，模块加载时编译一次
+_ORDER_INTENT_RE = re.compile("点外卖|订餐|下单|购买")
+_ACTION_INTENT_RE = re.compile("deliver|rest|complain", re.IGNORECASE)
+
+def _half(value: float) -> float:
+    """按0.5分桶；健康、幸福感、评分写入提示词前取值到与决策缓存相近的粒度，温度在模板中取整"""
+    return round(value * 2) / 2
+
+# 单个Agent逐次抽样时的预抽样池大小，用完后整池重新抽样
+RNG_POOL_SIZE = 4096
+# 客户计算评分均值时保留的最近评分数
+RATING_WINDOW = 5
+
+class UniformPool:
+    """
+    从群体的随机数生成器批量预抽[0, 1)均匀数，供单个Agent逐次取用。
+
+    Generator的标量调用（random()/integers()/uniform()）每次约0.4-1.4µs，
+    从预抽的列表中取一个数只需几十纳秒；给定seed时结果仍可复现。
+    """
+    __slots__ = ("_rng", "_buf", "_i")
+    
+    def __init__(self, rng: np.random.Generator):
+        self._rng = rng
+        self._buf: List[float] = []
+        self._i = 0
+    
+    def random(self) -> float:
+        i = self._i
+        if i >= len(self._buf):
+            self._buf = self._rng.random(RNG_POOL_SIZE).tolist()
+            i = 0
+        self._i = i + 1
+        return self._buf[i]
+    
+    def uniform(self, low: float, high: float) -> float:
+        return low + (high - low) * self.random()
+    
+    def integers(self, low: int, high: int) -> int:
+        """[low, high)内的随机整数，与Generator.integers的区间约定相同"""
+        return low + int(self.random() * (high - low))
+
+@dataclass
+class CustomerArray:
+    """
+    客户群体状态(SoA)，每个字段为长度等于客户数的数组。
+
+    LLMCustomer只保存自己在数组中的下标，规则决策模式下可以一次为所有客户计算下单概率。
+    ratings为每个客户最近RATING_WINDOW次评分的环形缓冲区，rating_pos为下一次写入的位置；
+    评分和/评分次数随add_rating增量维护，均值不必重新遍历窗口。
+    """
+    last_order_hour: np.ndarray
+    ratings: np.ndarray
+    rating_pos: np.ndarray
+    rating_sum: np.ndarray
+    rating_count: np.ndarray
+    rng: np.random.Generator = field(default_factory=np.random.default_rng)
+    draws: UniformPool = field(init=False, repr=False)  # 单个客户评分、小费等逐次抽样
+    
+    def __post_init__(self):
+        self.draws = UniformPool(self.rng)
+    
+    @classmethod
+    def create(cls, n: int, seed=None) -> "CustomerArray":
+        return cls(
+            last_order_hour=np.full(n, -99, dtype=np.int64),
+            ratings=np.zeros((n, RATING_WINDOW), dtype=np.uint8),
+            rating_pos=np.zeros(n, dtype=np.uint8),
+            rating_sum=np.zeros(n, dtype=np.int64),
+            rating_count=np.zeros(n, dtype=np.int64),
+            rng=np.random.default_rng(seed)
+        )
+    
+    def avg_ratings(self) -> np.ndarray:
+        """所有客户的历史评分均值，无评分时为5.0"""
+        count = self.rating_count
+        return np.where(count > 0, self.rating_sum / np.maximum(count, 1), 5.0)
+    
+    def add_rating(self, i: int, rating: int):
+        """把第i个客户的一次评分写入环形缓冲区，窗口已满时覆盖最早的评分"""
+        pos = self.rating_pos[i]
+        if self.rating_count[i] == RATING_WINDOW:
+            self.rating_sum[i] -= self.ratings[i, pos]
+        else:
+            self.rating_count[i] += 1
+        self.ratings[i, pos] = rating
+        self.rating_sum[i] += rating
+        self.rating_pos[i] = (pos + 1) % RATING_WINDOW
+    
+    def add_ratings(self, indices: np.ndarray, ratings: np.ndarray):
+        """
+        批量写入评分，结果与按顺序逐个调用add_rating相同。
+
+        同一客户在一批中可能有多个评分，按出现顺序分轮写入，每轮每个客户只写一次。
+        """
+        pending = np.arange(indices.shape[0])
+        while pending.size:
+            _, first = np.unique(indices[pending], return_index=True)
+            rows = pending[first]
+            cols = indices[rows]
+            pos = self.rating_pos[cols]
+            full = self.rating_count[cols] == RATING_WINDOW
+            self.rating_sum[cols] -= np.where(full, self.ratings[cols, pos], 0)
+            self.rating_count[cols] += ~full
+            self.ratings[cols, pos] = ratings[rows]
+            self.rating_sum[cols] += ratings[rows]
+            self.rating_pos[cols] = (pos + 1) % RATING_WINDOW
+            pending = np.delete(pending, first)
+    
+    def settle_orders(self, indices: np.ndarray, rider_health: np.ndarray):
+        """
+        按LLMCustomer.rate_order和decide_tip的规则一次为一批订单评分、定小费，并写入评分窗口。
+
+        评分 = 5 - [骑手健康<5] - [骑手健康<3] + 随机扰动(-1/0/1)，截断到1-5星；
+        骑手健康<3时给2-5元同情小费，否则评分>=4时给1-3元满意小费。
+        整批所需的随机数由共享生成器一次抽出。
+
+        Args:
+            indices: 每个订单的客户下标
+            rider_health: 每个订单配送完成后骑手的健康值
+
+        Returns:
+            (ratings, tips)
+        """
+        uniforms = self.rng.random((indices.shape[0], 2))
+        noise = (uniforms[:, 0] * 3).astype(np.int64) - 1
+        ratings = np.clip(5 - (rider_health < 5) - (rider_health < 3) + noise, 1, 5)
+        tips = np.where(rider_health < 3, 2 + 3 * uniforms[:, 1],
+                        np.where(ratings >= 4, 1 + 2 * uniforms[:, 1], 0.0))
+        self.add_ratings(indices, ratings)
+        return ratings, tips
+    
+    def recent_ratings(self, i: int) -> List[int]:
+        """第i个客户最近的评分，按时间从早到晚排列"""
+        count = int(self.rating_count[i])
+        if count < RATING_WINDOW:
+            return self.ratings[i, :count].tolist()
+        return np.roll(self.ratings[i], -int(self.rating_pos[i])).tolist()
+    
+    def rule_order_mask(self, temp: float, hour: int):
+        """
+        按LLMCustomer._rule_based_order_decision的规则一次决定所有客户是否下单（仅用餐时间调用）。
+
+        Returns:
+            (eligible, ordering): 未被4小时防重复限制的客户，以及其中决定下单的客户
+        """
+        eligible = (hour - self.last_order_hour) >= 4
+        temp_factor = max(0.1, 1.0 - (temp - 30) / 20)
+        order_prob = temp_factor * (self.avg_ratings() / 5.0) * 0.4
+        ordering = eligible & (self.rng.random(eligible.shape[0]) < order_prob)
+        return eligible, ordering
+
+@dataclass
+class RiderArray:
+    """
+    骑手群体状态(SoA)，每个字段为长度等于骑手数的数组。
+
+    LLMRider的health/money等属性读写这里的对应元素，规则决策模式下一小时内
+    所有骑手的决策和状态更新由编译内核一次完成。
+    """
+    health: np.ndarray
+    money: np.ndarray
+    happiness: np.ndarray
+    on_duty: np.ndarray
+    orders_completed: np.ndarray
+    daily_income: np.ndarray
+    complaint_count: np.ndarray  # 每个骑手的累计投诉次数，随LLMRider.complain递增
+    rng: np.random.Generator = field(default_factory=np.random.default_rng)
+    draws: UniformPool = field(init=False, repr=False)  # 单个骑手规则决策的逐次抽样
+    
+    def __post_init__(self):
+        self.draws = UniformPool(self.rng)
+    
+    @classmethod
+    def create(cls, n: int, seed=None) -> "RiderArray":
+        return cls(
+            health=np.full(n, 10.0),
+            money=np.full(n, 1000.0),
+            happiness=np.full(n, 5.0),
+            on_duty=np.ones(n, dtype=bool),
+            orders_completed=np.zeros(n, dtype=np.int64),
+            daily_income=np.zeros(n),
+            complaint_count=np.zeros(n, dtype=np.int64),
+            rng=np.random.default_rng(seed)
+        )
+    
+    @staticmethod
+    def of(riders: List[Any]) -> Optional["RiderArray"]:
+        """riders为同一RiderArray上的全部骑手时返回该数组（统计量与顺序无关），否则返回None"""
+        state = getattr(riders[0], "_state", None) if riders else None
+        if isinstance(state, RiderArray) and len(riders) == state.health.shape[0]:
+            return state
+        return None
+    
+    def step_rule(self, temp: float, shelter_rate: float, rest_rate: float,
+                  distances: np.ndarray, incomes: np.ndarray):
+        """
+        规则决策模式下推进所有骑手一小时，见kernels.rule_rider_step。
+        接单的骑手按距离从近到远依次分得订单。
+
+        Args:
+            distances: 当前可接订单的距离
+            incomes: 当前可接订单的骑手收入
+
+        Returns:
+            (actions, assigned, health_loss, recovery)：行动编码、分得的订单下标（未分得为-1）、
+            健康损失和休息骑手恢复的健康
+        """
+        n = self.health.shape[0]
+        actions, assigned, health_loss, recovery, _, _, _ = rule_rider_step(
+            self.health, self.money, self.happiness, self.daily_income,
+            self.orders_completed, self.on_duty, temp, shelter_rate, rest_rate,
+            self.rng.random((n, 3)), self.rng.permutation(n),
+            np.argsort(distances, kind="stable"), distances, incomes
+        )
+        return actions, assigned, health_loss, recovery
 
 class LLMCustomer(LLMEnhancedAgent):
     """集成LLM的客户Agent"""
     
-    def __init__(self, customer_id: str):
+    __slots__ = ("_state", "_index", "order_history")
+    
+    last_order_hour = _array_field("last_order_hour", int)  # 记录上次下单时间，防止短时重复下单
+    
+    def __init__(self, customer_id: str, state: Optional[CustomerArray] = None, index: int = 0):
         super().__init__("Customer", customer_id)
-        self.last_ratings = deque(maxlen=5)
+        self._state = state if state is not None else CustomerArray.create(1)
+        self._index = index
         self.order_history = []
-        self.last_order_hour = -99  # 记录上次下单时间，防止短时重复下单
+    
+    @property
+    def last_ratings(self) -> List[int]:
+        """最近5次评分，按时间从早到晚排列"""
+        return self._state.recent_ratings(self._index)
+        
+    def avg_rating(self) -> float:
+        """最近5次评分均值，无评分时为5.0"""
+        count = self._state.rating_count[self._index]
+        return float(self._state.rating_sum[self._index] / count) if count else 5.0
+    
+    def _observe(self, temp: float, hour: int, is_meal_time: bool, avg_rating: float):
+        self.add_observation("当前温度{:.1f}°C，时间{}点，用餐时间:{}，历史评分均值{:.1f}",
+                             temp, hour, is_meal_time, avg_rating)
         
     def observe_and_decide(self, environment: Environment, decision_mode: str = 'llm') -> Optional[Order]:
         """观察环境并做出点餐决策"""
+        context = self._begin_decision(environment)
+        if context is None:
+            return None
+        
+        # 使用LLM进行决策
+        decision = None
+        if decision_mode == 'llm' and deepseek_client.is_available():
+            decision = self.llm_decide(agent_prompts.CUSTOMER_SYSTEM, self._order_prompt(*context),
+                                       self._decision_key(context))
+        return self._finish_decision(environment, context, decision)
+    
+    async def aobserve_and_decide(self, environment: Environment, decision_mode: str = 'llm') -> Optional[Order]:
+        """observe_and_decide的异步版本，LLM请求期间不阻塞事件循环"""
+        context = self._begin_decision(environment)
+        if context is None:
+            return None
+        
+        decision = None
+        if decision_mode == 'llm' and deepseek_client.is_available():
+            decision = await self.allm_decide(agent_prompts.CUSTOMER_SYSTEM, self._order_prompt(*context),
+                                              self._decision_key(context))
+        return self._finish_decision(environment, context, decision)
+    
+    @classmethod
+    async def abatch_decide(cls, customers: List["LLMCustomer"], environment: Environment,
+                            decision_mode: str = 'llm') -> List[Optional[Order]]:
+        """
+        一次LLM调用为一批客户做点餐决策。
+
+        同一小时内客户看到的环境相同，只把各自的历史评分列在一个提示词中；
+        返回结果中缺少的客户按单个决策失败的情况降级到规则决策。
+
+        Returns:
+            与customers一一对应的订单，未下单的为None
+        """
+        contexts = [customer._begin_decision(environment) for customer in customers]
+        use_llm = decision_mode == 'llm' and deepseek_client.is_available()
+        decisions = {}
+        if use_llm:
+            # 命中缓存的客户不再列入提示词
+            for customer, context in zip(customers, contexts):
+                if context is not None:
+                    cached = customer.cached_decision(customer._decision_key(context))
+                    if cached is not None:
+                        decisions[customer.agent_id] = cached
+            pending = [(customer, context) for customer, context in zip(customers, contexts)
+                       if context is not None and customer.agent_id not in decisions]
+            if pending:
+                fresh = await allm_decide_batch(agent_prompts.CUSTOMER_SYSTEM, cls._batch_order_prompt(pending))
+                for customer, context in pending:
+                    decision = fresh.get(customer.agent_id)
+                    if decision is None:
+                        decision = customer._fallback_decide("")
+                    else:
+                        customer.record_llm_decision(decision)
+                        customer.cache_decision(customer._decision_key(context), decision)
+                    decisions[customer.agent_id] = decision
+        
+        results = []
+        for customer, context in zip(customers, contexts):
+            if context is None:
+                results.append(None)
+                continue
+            results.append(customer._finish_decision(environment, context, decisions.get(customer.agent_id)))
+        return results
+    
+    def _begin_decision(self, environment: Environment):
+        """检查是否需要决策并记录观察，需要时返回(hour, temp, avg_rating)，否则返回None"""
         environment_state = environment.get_environment_state()
-        hour = environment_state["hour"]
-        is_meal_time = environment_state["is_meal_time"]
+        hour = environment_state.hour
+        is_meal_time = environment_state.is_meal_time
 
         # 检查是否在用餐时间
         if not is_meal_time:
@@ -37,72 +350,79 @@ class LLMCustomer(LLMEnhancedAgent):
         if (hour - self.last_order_hour) < 4:
              return None
 
-        temp = environment_state["temperature"]
-        avg_rating = float(np.mean(self.last_ratings) if self.last_ratings else 5.0)
+        temp = environment_state.temperature
+        avg_rating = self.avg_rating()
         
         # 构建观察信息
-        observation = f"当前温度{temp:.1f}°C，时间{hour}点，用餐时间:{is_meal_time}，历史评分均值{avg_rating:.1f}"
-        self.add_observation(observation)
-        
-        # 使用LLM进行决策
-        if decision_mode == 'llm' and deepseek_client.is_available():
-            user_prompt = f"""
-当前环境:
-- 温度: {temp:.1f}°C
-- 时间: {hour}点 
-- 是否用餐时间: {is_meal_time}
-- 我的历史评分均值: {avg_rating:.1f}
-
-请决定是否点外卖？考虑因素：
-1. 高温对于外出就餐的便利程度
-2. 用餐时间更适合点餐
-3. 历史评分反映服务质量
-
-请回答 {{"order": true/false, "concern_level": "high/medium/low", "reasoning": "决策理由"}}
-"""
-            
-            decision = self.llm_decide(agent_prompts.CUSTOMER_SYSTEM, user_prompt)
-            
-            # 基于LLM决策结果
-            should_order = False
-            if decision.get("decision_type") == "rule_based":
-                # 降级到规则决策
-                should_order = self._rule_based_order_decision(temp, avg_rating, is_meal_time)
-            else:
-                # 解析LLM决策
-                if isinstance(decision.get("order"), bool):
-                    should_order = decision["order"]
-                elif "order" in decision and decision["order"] in ["true", "True", True]:
-                    should_order = True
-                elif "reasoning" in decision:
-                    # 从推理文本中判断意图
-                    reasoning = decision["reasoning"].lower()
-                    should_order = any(word in reasoning for word in ["点外卖", "订餐", "下单", "购买"])
-                else:
-                    should_order = self._rule_based_order_decision(temp, avg_rating, is_meal_time)
-        else:
+        self._observe(temp, hour, is_meal_time, avg_rating)
+        return hour, temp, avg_rating
+    
+    def _order_prompt(self, hour: int, temp: float, avg_rating: float) -> str:
+        """点餐决策的用户提示词（只在用餐时间决策）"""
+        return agent_prompts.CUSTOMER_USER.format(temp=temp, hour=hour, avg_rating=_half(avg_rating))
+    
+    @staticmethod
+    def _decision_key(context) -> tuple:
+        """决策缓存键：温度取整，评分按0.5分桶"""
+        hour, temp, avg_rating = context
+        return ("customer", hour, round(temp), round(avg_rating * 2) / 2)
+    
+    @staticmethod
+    def _batch_order_prompt(pending) -> str:
+        """批量点餐决策的用户提示词，pending为(客户, (hour, temp, avg_rating))列表"""
+        hour, temp, _ = pending[0][1]
+        customer_lines = "\n".join(f"- {customer.agent_id}: 历史评分均值{_half(context[2]):.1f}"
+                                    for customer, context in pending)
+        return agent_prompts.CUSTOMER_BATCH_USER.format(temp=temp, hour=hour, count=len(pending),
+                                                        customer_lines=customer_lines)
+    
+    def _parse_order_decision(self, decision: Dict[str, Any], temp: float, avg_rating: float) -> bool:
+        """解析LLM的点餐决策，无法解析时降级到规则决策"""
+        if decision.get("decision_type") == "rule_based":
+            # 降级到规则决策
+            return self._rule_based_order_decision(temp, avg_rating, True)
+        # 解析LLM决策
+        if isinstance(decision.get("order"), bool):
+            return decision["order"]
+        elif "order" in decision and decision["order"] in ["true", "True", True]:
+            return True
+        elif "reasoning" in decision:
+            # 从推理文本中判断意图
+            return _ORDER_INTENT_RE.search(decision["reasoning"]) is not None
+        return self._rule_based_order_decision(temp, avg_rating, True)
+    
+    def _finish_decision(self, environment: Environment, context, decision: Optional[Dict[str, Any]]) -> Optional[Order]:
+        """根据LLM决策（为None时按规则决策）决定是否下单，决定下单时创建订单"""
+        hour, temp, avg_rating = context
+        if decision is None:
             # 使用规则决策
             self.add_thought("规则决策：基于温度、用餐时间和历史评分决定是否下单")
-            should_order = self._rule_based_order_decision(temp, avg_rating, is_meal_time)
-        
-        # 如果决定下单，创建订单
-        if should_order and is_meal_time:
-            order = Order(
-                order_id=str(uuid.uuid4()),
-                customer_id=self.agent_id,
-                time=hour,
-                cost=environment.get_order_cost(),
-                distance=environment.get_order_distance()
-            )
-            self.last_order_hour = hour  # 更新下单时间
-            self.order_history.append(order)
-            action = f"下单 - 订单ID:{order.order_id[:8]}, 金额:{order.cost:.1f}元, 距离:{order.distance:.1f}km"
-            self.add_action(action)
-            return order
+            should_order = self._rule_based_order_decision(temp, avg_rating, True)
+        else:
+            should_order = self._parse_order_decision(decision, temp, avg_rating)
+        
+        if should_order:
+            return self.place_order(environment, hour)
         
         self.add_action("未下单")
         return None
     
+    def place_order(self, environment: Environment, hour: int) -> Order:
+        """创建订单"""
+        cost, distance = environment.draw_order()
+        order = Order(
+            order_id=next_order_id(),
+            customer_id=self.agent_id,
+            time=hour,
+            cost=cost,
+            distance=distance,
+            day=environment.current_day
+        )
+        self.last_order_hour = hour  # 更新下单时间
+        self.order_history.append(order)
+        self.add_action("下单 - 订单ID:{:.8}, 金额:{:.1f}元, 距离:{:.1f}km", order.order_id, order.cost, order.distance)
+        return order
+    
     def _rule_based_order_decision(self, temp: float, avg_rating: float, is_meal_time: bool) -> bool:
         """规则基础的下单决策"""
         if not is_meal_time:
@@ -112,7 +432,7 @@ class LLMCustomer(LLMEnhancedAgent):
         rating_factor = avg_rating / 5.0
         order_prob = temp_factor * rating_factor * 0.4
         
-        return random.random() < order_prob
+        return self._state.draws.random() < order_prob
     
     def rate_order(self, order: Order, rider_health: float) -> int:
         """对订单评分"""
@@ -122,113 +442,236 @@ class LLMCustomer(LLMEnhancedAgent):
         if rider_health < 3:
             base_rating -= 1
             
-        rating = max(1, min(5, base_rating + random.randint(-1, 1)))
-        self.last_ratings.append(rating)
-        order.rating = rating
-        
-        self.add_action(f"给订单{order.order_id[:8]}评分{rating}星")
+        rating = max(1, min(5, base_rating + self._state.draws.integers(-1, 2)))
+        self._state.add_rating(self._index, rating)
+        self._record_rating(order, rating)
         return rating
     
+    def _record_rating(self, order: Order, rating: int):
+        """把已写入评分窗口的评分记到订单和行动轨迹上"""
+        order.rating = rating
+        self.add_action("给订单{:.8}评分{}星", order.order_id, rating)
+    
     def decide_tip(self, order: Order, rider_health: float) -> float:
         """决定小费"""
         tip = 0
         if rider_health < 3:
-            tip = random.uniform(2, 5)  # 同情小费
+            tip = self._state.draws.uniform(2, 5)  # 同情小费
         elif order.rating and order.rating >= 4:
-            tip = random.uniform(1, 3)  # 满意小费
+            tip = self._state.draws.uniform(1, 3)  # 满意小费
             
+        self._record_tip(order, tip)
+        return tip
+    
+    def _record_tip(self, order: Order, tip: float):
+        """把小费记到订单和行动轨迹上"""
         order.tip = tip
         if tip > 0:
-            self.add_action(f"给订单{order.order_id[:8]}小费{tip:.1f}元")
-        return tip
+            self.add_action("给订单{:.8}小费{:.1f}元", order.order_id, tip)
 
 class LLMRider(LLMEnhancedAgent):
     """集成LLM的骑手Agent"""
     
-    def __init__(self, rider_id: str):
+    __slots__ = ("_state", "_index", "complaints")
+    
+    health = _array_field("health", float)
+    money = _array_field("money", float)
+    happiness = _array_field("happiness", float)
+    on_duty = _array_field("on_duty", bool)
+    orders_completed = _array_field("orders_completed", int)
+    daily_income = _array_field("daily_income", float)
+    
+    def __init__(self, rider_id: str, state: Optional[RiderArray] = None, index: int = 0):
         super().__init__("Rider", rider_id)
-        self.health = 10.0
-        self.money = 1000.0
-        self.on_duty = True
-        self.happiness = 5.0
-        self.orders_completed = 0
+        self._state = state if state is not None else RiderArray.create(1)
+        self._index = index
         self.complaints = []
-        self.daily_income = 0.0
         
-    def observe_and_decide(self, environment: Environment, available_orders: List[Order], decision_mode: str = 'llm') -> str:
-        """观察环境并决定行动"""
+    def _observe(self, temp: float, shelter_rate: float, order_count: int, health: float):
+        self.add_observation("温度{:.1f}°C，阴凉覆盖率{:.1f}，可接订单{}个，健康状况{:.1f}/10",
+                             temp, shelter_rate, order_count, health)
+        
+    def observe_and_decide(self, environment: Environment, order_count: int, decision_mode: str = 'llm') -> str:
+        """观察环境并决定行动；骑手只需要可接订单数，由调用方每小时统计一次后传入"""
+        use_llm = decision_mode == 'llm' and deepseek_client.is_available()
+        forced, temp, shelter_rate = self._begin_decision(environment, order_count, use_llm)
+        if forced:
+            return forced
+        
+        # 使用LLM进行决策
+        decision = None
+        if use_llm:
+            decision = self.llm_decide(agent_prompts.RIDER_SYSTEM, self._action_prompt(temp, shelter_rate, order_count),
+                                       self._decision_key(temp, shelter_rate, order_count))
+        return self._finish_decision(decision, temp, order_count)
+    
+    async def aobserve_and_decide(self, environment: Environment, order_count: int, decision_mode: str = 'llm') -> str:
+        """observe_and_decide的异步版本，LLM请求期间不阻塞事件循环"""
+        use_llm = decision_mode == 'llm' and deepseek_client.is_available()
+        forced, temp, shelter_rate = self._begin_decision(environment, order_count, use_llm)
+        if forced:
+            return forced
+        
+        decision = None
+        if use_llm:
+            decision = await self.allm_decide(agent_prompts.RIDER_SYSTEM, self._action_prompt(temp, shelter_rate, order_count),
+                                              self._decision_key(temp, shelter_rate, order_count))
+        return self._finish_decision(decision, temp, order_count)
+    
+    @classmethod
+    async def abatch_decide(cls, riders: List["LLMRider"], environment: Environment, order_count: int,
+                            decision_mode: str = 'llm') -> List[str]:
+        """
+        一次LLM调用为一批骑手决定行动。
+
+        所有骑手看到的环境和可接订单数相同，只把各自的健康、资金和幸福感列在一个提示词中；
+        返回结果中缺少的骑手降级到规则决策。
+
+        Returns:
+            与riders一一对应的行动
+        """
+        use_llm = decision_mode == 'llm' and deepseek_client.is_available()
+        starts = [rider._begin_decision(environment, order_count, use_llm) for rider in riders]
+        decisions = {}
+        if use_llm:
+            environment_state = environment.get_environment_state()
+            temp = environment_state.temperature
+            shelter_rate = environment_state.shelter_rate
+            # 命中缓存的骑手不再列入提示词
+            for rider, (forced, _, _) in zip(riders, starts):
+                if not forced:
+                    cached = rider.cached_decision(rider._decision_key(temp, shelter_rate, order_count))
+                    if cached is not None:
+                        decisions[rider.agent_id] = cached
+            pending = [rider for rider, (forced, _, _) in zip(riders, starts)
+                       if not forced and rider.agent_id not in decisions]
+            if pending:
+                prompt = cls._batch_action_prompt(pending, temp, shelter_rate, order_count)
+                fresh = await allm_decide_batch(agent_prompts.RIDER_SYSTEM, prompt)
+                for rider in pending:
+                    decision = fresh.get(rider.agent_id)
+                    if decision is None:
+                        decision = rider._fallback_decide("")
+                    else:
+                        rider.record_llm_decision(decision)
+                        rider.cache_decision(rider._decision_key(temp, shelter_rate, order_count), decision)
+                    decisions[rider.agent_id] = decision
+        
+        results = []
+        for rider, (forced, temp, _) in zip(riders, starts):
+            if forced:
+                results.append(forced)
+                continue
+            results.append(rider._finish_decision(decisions.get(rider.agent_id), temp, order_count))
+        return results
+    
+    def _begin_decision(self, environment: Environment, order_count: int, use_llm: bool = False):
+        """
+        记录观察并处理无需决策的情况。
+
+        use_llm为True且LLM_DIRECT_DECISIONS开启时，还会对无可接订单等明显占优的状态
+        直接给出行动（见_direct_decision），不再询问LLM。
+
+        Returns:
+            (forced, temp, shelter_rate)：forced为直接确定的行动，否则为None
+        """
         if not self.on_duty:
-            return "off_duty"
+            return "off_duty", 0.0, 0.0
             
         environment_state = environment.get_environment_state()
-        temp = environment_state["temperature"]
-        shelter_rate = environment_state["shelter_rate"]
-        order_count = len(available_orders)
+        temp = environment_state.temperature
+        shelter_rate = environment_state.shelter_rate
         
         # 构建观察信息
-        observation = f"温度{temp:.1f}°C，阴凉覆盖率{shelter_rate:.1f}，可接订单{order_count}个，健康状况{self.health:.1f}/10"
-        self.add_observation(observation)
+        self._observe(temp, shelter_rate, order_count, self.health)
         
         # 健康状况太差，强制休息
         if self.health < 2:
             self.add_action("健康状况危险，强制休息")
-            return "rest"
+            return "rest", temp, shelter_rate
         
-        # 使用LLM进行决策
-        if decision_mode == 'llm' and deepseek_client.is_available():
-            system_prompt = agent_prompts.RIDER_SYSTEM.format(
-                health=self.health,
-                money=self.money,
-                happiness=self.happiness
-            )
-            
-            user_prompt = f"""
-当前工作环境:
-- 温度: {temp:.1f}°C (极端高温>40°C)
-- 阴凉覆盖率: {shelter_rate:.1f}
-- 可接订单数: {order_count}
-- 我的健康状况: {self.health:.1f}/10
-- 当前资金: {self.money:.0f}元
-
-请选择最佳行动:
-1. deliver - 接单配送 (有收入但可能损害健康)
-2. rest - 休息恢复 (恢复健康但无收入)  
-3. complain - 投诉工作条件 (表达不满)
-
-请回答 {{"action": "deliver/rest/complain", "risk_level": "high/medium/low", "reasoning": "决策理由"}}
-"""
-            
-            decision = self.llm_decide(system_prompt, user_prompt)
-            
-            # 解析LLM决策
-            if decision.get("decision_type") == "rule_based":
-                return self._rule_based_action_decision(temp, order_count)
-            else:
-                action = decision.get("action", "").lower()
-                if action in ["deliver", "rest", "complain"]:
-                    return action
-                elif "deliver" in decision.get("reasoning", "").lower() and order_count > 0:
-                    return "deliver"
-                elif "rest" in decision.get("reasoning", "").lower():
-                    return "rest"
-                elif "complain" in decision.get("reasoning", "").lower():
-                    return "complain"
-                else:
-                    return self._rule_based_action_decision(temp, order_count)
+        if use_llm and LLM_DIRECT_DECISIONS:
+            direct = self._direct_decision(temp, order_count)
+            if direct is not None:
+                return direct, temp, shelter_rate
+        return None, temp, shelter_rate
+    
+    def _direct_decision(self, temp: float, order_count: int) -> Optional[str]:
+        """
+        LLM模式下明显占优的状态直接决策，返回行动，其余情况返回None交给LLM：
+        无可接订单且健康>=3时规则的结果必然是休息；健康<3且温度>42°C时休息；
+        健康>=8、温度在30-38°C之间且订单充足时接单。
+        无可接订单但健康在2-3之间时规则约有30%会投诉，仍交给LLM。
+        """
+        health = self.health
+        if order_count == 0 and health >= 3:
+            action, reason = "rest", "无可接订单"
+        elif health < 3 and temp > 42:
+            action, reason = "rest", "健康较差且极端高温"
+        elif health >= 8 and 30 < temp < 38 and order_count > 3:
+            action, reason = "deliver", "健康良好、温度适中且订单充足"
         else:
+            return None
+        self.add_thought("规则快速决策：{}，{}", reason, "休息" if action == "rest" else "接单")
+        return action
+    
+    def _action_prompt(self, temp: float, shelter_rate: float, order_count: int) -> str:
+        """行动决策的用户提示词"""
+        return agent_prompts.RIDER_USER.format(temp=temp, shelter_rate=shelter_rate, order_count=order_count,
+                                               health=_half(self.health), money=self.money,
+                                               happiness=_half(self.happiness))
+    
+    def _decision_key(self, temp: float, shelter_rate: float, order_count: int) -> tuple:
+        """决策缓存键：温度、健康、幸福感取整，资金按500元分桶，订单数3个以上视为相同"""
+        return ("rider", round(temp), round(shelter_rate, 1), min(order_count, 3),
+                round(self.health), round(self.happiness), int(self.money // 500))
+    
+    @staticmethod
+    def _batch_action_prompt(riders: List["LLMRider"], temp: float, shelter_rate: float, order_count: int) -> str:
+        """批量行动决策的用户提示词"""
+        rider_lines = "\n".join(
+            f"- {rider.agent_id}: 健康状况{_half(rider.health):.1f}/10，当前资金{rider.money:.0f}元，幸福感{_half(rider.happiness):.1f}/10"
+            for rider in riders
+        )
+        return agent_prompts.RIDER_BATCH_USER.format(temp=temp, shelter_rate=shelter_rate, order_count=order_count,
+                                                     count=len(riders), rider_lines=rider_lines)
+    
+    def _finish_decision(self, decision: Optional[Dict[str, Any]], temp: float, order_count: int) -> str:
+        """根据LLM决策确定行动，decision为None时按规则决策"""
+        if decision is None:
             self.add_thought("规则决策：基于健康、温度和订单数决定行动")
             return self._rule_based_action_decision(temp, order_count)
+        return self._parse_action_decision(decision, temp, order_count)
+    
+    def _parse_action_decision(self, decision: Dict[str, Any], temp: float, order_count: int) -> str:
+        """解析LLM的行动决策，无法解析时降级到规则决策"""
+        if decision.get("decision_type") == "rule_based":
+            return self._rule_based_action_decision(temp, order_count)
+        action = decision.get("action", "").lower()
+        if action in ["deliver", "rest", "complain"]:
+            return action
+        # 一次扫描找出推理文本中出现的所有行动词，再按deliver > rest > complain的优先级取用
+        mentioned = {word.lower() for word in _ACTION_INTENT_RE.findall(decision.get("reasoning", ""))}
+        if "deliver" in mentioned and order_count > 0:
+            return "deliver"
+        elif "rest" in mentioned:
+            return "rest"
+        elif "complain" in mentioned:
+            return "complain"
+        else:
+            return self._rule_based_action_decision(temp, order_count)
     
     def _rule_based_action_decision(self, temp: float, order_count: int) -> str:
         """规则基础的行动决策"""
-        if self.health < 3 and random.random() < 0.3:
+        rand = self._state.draws.random
+        if self.health < 3 and rand() < 0.3:
             return "complain"
-        elif temp > 42 and self.health < 6 and random.random() < 0.7:
+        elif temp > 42 and self.health < 6 and rand() < 0.7:
             return "rest"
         elif order_count > 0 and self.health >= 3:
             health_factor = self.health / 10.0
             temp_factor = max(0.1, 1.0 - (temp - 35) / 15)
-            if random.random() < health_factor * temp_factor:
+            if rand() < health_factor * temp_factor:
                 return "deliver"
         
         return "rest"
@@ -236,16 +679,12 @@ class LLMRider(LLMEnhancedAgent):
     def deliver_order(self, order: Order, environment: Environment) -> Dict:
         """配送订单"""
         environment_state = environment.get_environment_state()
-        temp = environment_state["temperature"]
-        shelter_rate = environment_state["shelter_rate"]
+        temp = environment_state.temperature
+        shelter_rate = environment_state.shelter_rate
         
         # 计算健康损失
-        K = 0.2
-        health_loss = (temp - 35) * K * order.distance * (1 - shelter_rate)
-        health_loss = max(0, health_loss)
-        
-        self.health -= health_loss
-        self.health = max(0, self.health)
+        loss = delivery_health_loss(temp, order.distance, shelter_rate)
+        self.health = max(0, self.health - loss)
         
         # 计算收入
         base_income = order.cost * 0.2
@@ -258,53 +697,53 @@ class LLMRider(LLMEnhancedAgent):
         order.delivered = True
         
         self.update_happiness(environment)
-        
-        action = f"完成订单{order.order_id[:8]}，收入{total_income:.1f}元，健康损失{health_loss:.1f}"
-        self.add_action(action)
+        self.record_delivery(order, total_income, loss)
         
         return {
             "order": order,
             "income": total_income,
-            "health_loss": health_loss
+            "health_loss": loss
         }
     
     def rest(self, environment: Environment):
         """休息恢复"""
         environment_state = environment.get_environment_state()
-        rest_rate = environment_state["rest_rate"]
-        temp = environment_state["temperature"]
+        rest_rate = environment_state.rest_rate
+        temp = environment_state.temperature
         
-        recovery = 0.5 * rest_rate if temp > 40 else 1.0 * rest_rate
-        self.health += recovery
-        self.health = min(10, self.health)
+        recovery = rest_recovery(temp, rest_rate)
+        self.health = min(10, self.health + recovery)
         
-        self.add_action(f"休息恢复健康{recovery:.1f}，当前健康{self.health:.1f}/10")
+        self.record_rest(recovery)
+    
+    def record_delivery(self, order: Order, income: float, health_loss: float):
+        """记录配送行动"""
+        self.add_action("完成订单{:.8}，收入{:.1f}元，健康损失{:.1f}", order.order_id, income, health_loss)
+    
+    def record_rest(self, recovery: float):
+        """记录休息行动"""
+        self.add_action("休息恢复健康{:.1f}，当前健康{:.1f}/10", recovery, self.health)
     
     def complain(self, environment: Environment):
         """投诉"""
         environment_state = environment.get_environment_state()
         complaint = {
             "rider_id": self.agent_id,
-            "day": environment_state["day"],
-            "hour": environment_state["hour"],
+            "day": environment_state.day,
+            "hour": environment_state.hour,
             "health": self.health,
-            "temperature": environment_state["temperature"],
+            "temperature": environment_state.temperature,
             "reason": "极端高温工作条件恶劣"
         }
         self.complaints.append(complaint)
+        self._state.complaint_count[self._index] += 1
         
-        self.add_action(f"投诉工作条件，健康{self.health:.1f}/10，温度{environment_state['temperature']:.1f}°C")
+        self.add_action("投诉工作条件，健康{:.1f}/10，温度{:.1f}°C", self.health, environment_state.temperature)
         return complaint
     
     def update_happiness(self, environment: Environment):
         """更新幸福感"""
-        environment_state = environment.get_environment_state()
-        health_factor = self.health / 10.0
-        money_factor = min(1.0, self.money / 2000.0)
-        temp_factor = max(0.1, 1.0 - (environment_state["temperature"] - 30) / 20)
-        
-        self.happiness = (health_factor * 0.4 + money_factor * 0.3 + temp_factor * 0.3) * 10
-        self.happiness = max(0, min(10, self.happiness))
+        self.happiness = rider_happiness(self.health, self.money, environment.get_environment_state().temperature)
     
     def get_status(self) -> Dict:
         """获取状态"""
@@ -321,6 +760,8 @@ class LLMRider(LLMEnhancedAgent):
 class LLMGovernment(LLMEnhancedAgent):
     """集成LLM的政府Agent"""
     
+    __slots__ = ("budget", "subsidies_paid", "shelters_built")
+    
     def __init__(self):
         super().__init__("Government", "government")
         self.budget = 0.0
@@ -329,35 +770,59 @@ class LLMGovernment(LLMEnhancedAgent):
         
     def observe_and_decide(self, environment: Environment, riders: List[LLMRider], decision_mode: str = 'llm') -> Dict[str, Any]:
         """观察社会状况并制定政策"""
+        context = self._begin_decision(environment, riders)
+        
+        # 使用LLM进行政策决策
+        decision = None
+        if decision_mode == 'llm' and deepseek_client.is_available() and context[-1]:
+            decision = self.llm_decide(agent_prompts.GOVERNMENT_SYSTEM, self._policy_prompt(*context[:-1]))
+        return self._finish_decision(riders, context, decision)
+    
+    async def aobserve_and_decide(self, environment: Environment, riders: List[LLMRider],
+                                  decision_mode: str = 'llm') -> Dict[str, Any]:
+        """observe_and_decide的异步版本，LLM请求期间不阻塞事件循环"""
+        context = self._begin_decision(environment, riders)
+        
+        decision = None
+        if decision_mode == 'llm' and deepseek_client.is_available() and context[-1]:
+            decision = await self.allm_decide(agent_prompts.GOVERNMENT_SYSTEM, self._policy_prompt(*context[:-1]))
+        return self._finish_decision(riders, context, decision)
+    
+    def _begin_decision(self, environment: Environment, riders: List[LLMRider]):
+        """
+        记录观察并汇总决策所需的状况。
+
+        Returns:
+            (temp, complaints, unhealthy_riders, shelter_rate, can_act)，can_act为False时任何决策都没有效果
+        """
         environment_state = environment.get_environment_state()
-        temp = environment_state["temperature"]
-        complaints = sum(len(r.complaints) for r in riders)
-        unhealthy_riders = len([r for r in riders if r.health < 5])
-        shelter_rate = environment_state["shelter_rate"]
+        temp = environment_state.temperature
+        arrays = RiderArray.of(riders)
+        if arrays is not None:
+            complaints = int(arrays.complaint_count.sum())
+            unhealthy_riders = int(np.count_nonzero(arrays.health < 5))
+        else:
+            complaints = sum(len(r.complaints) for r in riders)
+            unhealthy_riders = len([r for r in riders if r.health < 5])
+        shelter_rate = environment_state.shelter_rate
         
         observation = f"温度{temp:.1f}°C，{complaints}次投诉，{unhealthy_riders}个骑手健康不佳，覆盖率{shelter_rate:.2f}"
         self.add_observation(observation)
         
-        # 使用LLM进行政策决策
-        if decision_mode == 'llm' and deepseek_client.is_available():
-            user_prompt = f"""
-当前社会状况:
-- 温度: {temp:.1f}°C
-- 骑手投诉数: {complaints}
-- 健康状况不佳骑手数: {unhealthy_riders}
-- 纳凉点覆盖率: {shelter_rate:.2f}
-- 政府预算: {self.budget:.0f}元
-
-请制定政策措施：
-1. 高温补贴：温度>38°C时每人30-50元，>42°C时50-100元
-2. 增设纳凉点：投诉多且覆盖率<0.8时考虑，成本1000元
-3. 紧急程度评估
-
-请回答 {{"subsidy_amount": 数字, "build_shelter": true/false, "urgency": "high/medium/low", "reasoning": "政策理由"}}
-"""
-            
-            decision = self.llm_decide(agent_prompts.GOVERNMENT_SYSTEM, user_prompt)
-        else:
+        # 温度不超过38°C时不会发放补贴，预算不足或覆盖率已达上限时也不能增设纳凉点，
+        # 两者都不成立时任何决策都没有效果，直接按规则处理
+        can_act = temp > 38 or (self.budget >= 1000 and shelter_rate < 0.8)
+        return temp, complaints, unhealthy_riders, shelter_rate, can_act
+    
+    def _policy_prompt(self, temp: float, complaints: int, unhealthy_riders: int, shelter_rate: float) -> str:
+        """政策决策的用户提示词"""
+        return agent_prompts.GOVERNMENT_USER.format(temp=temp, complaints=complaints, unhealthy_riders=unhealthy_riders,
+                                                    shelter_rate=shelter_rate, budget=self.budget)
+    
+    def _finish_decision(self, riders: List[LLMRider], context, decision: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """执行政策决策；decision为None时使用规则决策"""
+        temp, complaints, unhealthy_riders, shelter_rate, _ = context
+        if decision is None:
             self.add_thought("规则决策：基于温度、投诉和健康状况制定政策")
             decision = self._rule_based_policy_decision(temp, complaints, unhealthy_riders, shelter_rate)
         
@@ -400,12 +865,18 @@ class LLMGovernment(LLMEnhancedAgent):
         return decision
     
     def _provide_subsidy(self, riders: List[LLMRider], amount_per_rider: float) -> float:
-        """发放高温补贴"""
-        total_subsidy = 0
-        for rider in riders:
-            if rider.on_duty:
-                rider.money += amount_per_rider
-                total_subsidy += amount_per_rider
+        """发放高温补贴，骑手为同一RiderArray上的全部骑手时直接对在职骑手的资金数组整体加补贴"""
+        arrays = RiderArray.of(riders)
+        if arrays is not None:
+            on_duty = arrays.on_duty
+            arrays.money[on_duty] += amount_per_rider
+            total_subsidy = amount_per_rider * int(np.count_nonzero(on_duty))
+        else:
+            total_subsidy = 0
+            for rider in riders:
+                if rider.on_duty:
+                    rider.money += amount_per_rider
+                    total_subsidy += amount_per_rider
         
         self.budget -= total_subsidy
         self.subsidies_paid += total_subsidy
@@ -431,6 +902,8 @@ class LLMGovernment(LLMEnhancedAgent):
 class LLMPlatform(LLMEnhancedAgent):
     """集成LLM的平台Agent"""
     
+    __slots__ = ("cash", "daily_revenue", "rider_pay_rate")
+    
     def __init__(self):
         super().__init__("Platform", "platform")
         self.cash = 5000.0
@@ -439,34 +912,55 @@ class LLMPlatform(LLMEnhancedAgent):
         
     def observe_and_decide(self, riders: List[LLMRider], orders: List[Order], decision_mode: str = 'llm') -> Dict[str, Any]:
         """观察运营状况并做决策"""
-        active_riders = len([r for r in riders if r.on_duty])
-        completed_orders = len([o for o in orders if o.delivered])
-        avg_health = float(np.mean([r.health for r in riders]) if riders else 10.0)
-        complaints = sum(len(r.complaints) for r in riders)
-        
-        observation = f"{active_riders}个骑手在职，完成{completed_orders}个订单，平均健康{avg_health:.1f}，{complaints}次投诉"
-        self.add_observation(observation)
+        context = self._begin_decision(riders, orders)
         
         # 使用LLM进行运营决策
+        decision = None
         if decision_mode == 'llm' and deepseek_client.is_available():
-            user_prompt = f"""
-平台运营状况:
-- 在职骑手数: {active_riders}
-- 今日完成订单: {completed_orders}
-- 骑手平均健康: {avg_health:.1f}/10
-- 收到投诉数: {complaints}
-- 平台资金: {self.cash:.0f}元
-
-请做出运营决策：
-1. 薪酬调整：可提高或降低骑手分成比例
-2. 人员管理：是否解雇表现差的骑手
-3. 风险评估：评估当前运营风险
-
-请回答 {{"adjust_pay": 1.0, "fire_riders": false, "risk_level": "low", "reasoning": "决策理由"}}
-"""
-            
-            decision = self.llm_decide(agent_prompts.PLATFORM_SYSTEM, user_prompt)
+            decision = self.llm_decide(agent_prompts.PLATFORM_SYSTEM, self._business_prompt(*context))
+        return self._finish_decision(riders, context, decision)
+    
+    async def aobserve_and_decide(self, riders: List[LLMRider], orders: List[Order],
+                                  decision_mode: str = 'llm') -> Dict[str, Any]:
+        """observe_and_decide的异步版本，LLM请求期间不阻塞事件循环"""
+        context = self._begin_decision(riders, orders)
+        
+        decision = None
+        if decision_mode == 'llm' and deepseek_client.is_available():
+            decision = await self.allm_decide(agent_prompts.PLATFORM_SYSTEM, self._business_prompt(*context))
+        return self._finish_decision(riders, context, decision)
+    
+    def _begin_decision(self, riders: List[LLMRider], orders: List[Order]):
+        """
+        记录观察并汇总运营数据。
+
+        Returns:
+            (active_riders, completed_orders, avg_health, complaints)
+        """
+        completed_orders = len([o for o in orders if o.delivered])
+        arrays = RiderArray.of(riders)
+        if arrays is not None:
+            active_riders = int(arrays.on_duty.sum())
+            avg_health = float(arrays.health.mean())
+            complaints = int(arrays.complaint_count.sum())
         else:
+            active_riders = len([r for r in riders if r.on_duty])
+            avg_health = sum(r.health for r in riders) / len(riders) if riders else 10.0
+            complaints = sum(len(r.complaints) for r in riders)
+        
+        observation = f"{active_riders}个骑手在职，完成{completed_orders}个订单，平均健康{avg_health:.1f}，{complaints}次投诉"
+        self.add_observation(observation)
+        return active_riders, completed_orders, avg_health, complaints
+    
+    def _business_prompt(self, active_riders: int, completed_orders: int, avg_health: float, complaints: int) -> str:
+        """运营决策的用户提示词"""
+        return agent_prompts.PLATFORM_USER.format(active_riders=active_riders, completed_orders=completed_orders,
+                                                  avg_health=_half(avg_health), complaints=complaints, cash=self.cash)
+    
+    def _finish_decision(self, riders: List[LLMRider], context, decision: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """执行运营决策；decision为None时使用规则决策"""
+        active_riders, _, avg_health, complaints = context
+        if decision is None:
             self.add_thought("规则决策：基于骑手健康和投诉情况进行业务决策")
             decision = self._rule_based_business_decision(active_riders, avg_health, complaints)
         
@@ -508,22 +1002,30 @@ class LLMPlatform(LLMEnhancedAgent):
         return decision
     
     def _fire_poor_performers(self, riders: List[LLMRider]) -> int:
-        """解雇表现差的骑手"""
-        fired_count = 0
-        for rider in riders:
-            if rider.health < 1 or len(rider.complaints) > 5:
-                rider.on_duty = False
-                fired_count += 1
+        """解雇表现差的骑手（健康低于1或投诉超过5次），骑手为同一RiderArray上的全部骑手时向量化判断"""
+        arrays = RiderArray.of(riders)
+        if arrays is not None:
+            poor = (arrays.health < 1) | (arrays.complaint_count > 5)
+            arrays.on_duty[poor] = False
+            fired_count = int(np.count_nonzero(poor))
+        else:
+            fired_count = 0
+            for rider in riders:
+                if rider.health < 1 or len(rider.complaints) > 5:
+                    rider.on_duty = False
+                    fired_count += 1
                 
         if fired_count > 0:
             self.add_action(f"解雇{fired_count}名表现差的骑手")
         
         return fired_count
     
-    def calc_profit(self, orders: List[Order]) -> float:
-        """计算收益"""
-        daily_orders = [o for o in orders if o.delivered]
-        revenue = sum(o.cost * 0.8 for o in daily_orders)
+    def calc_profit(self, orders, day: Optional[int] = None) -> float:
+        """计算收益，orders可以是订单列表或OrderLedger（此时只统计day当天下单的订单）"""
+        if isinstance(orders, OrderLedger):
+            revenue = orders.delivered_revenue(0.8, day)
+        else:
+            revenue = sum(o.cost * 0.8 for o in orders if o.delivered)
         self.daily_revenue = revenue
         self.cash += revenue
         
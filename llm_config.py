@@ -5,14 +5,57 @@
 
 import os
 import json
-from typing import Dict, Any, List, Optional, cast
+import asyncio
+import atexit
+import hashlib
+import shelve
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, cast
 from dotenv import load_dotenv
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 from openai.types.chat import ChatCompletionMessageParam
 
+try:
+    import orjson  # 可选依赖，解析LLM返回的JSON更快
+except ImportError:
+    orjson = None
+
+try:
+    import h2  # noqa: F401  可选依赖，安装后连接池走HTTP/2多路复用
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+import agents
+from agents import TraceLog
+
 # 加载环境变量
 load_dotenv()
 
+# 是否按分桶后的状态缓存LLM决策，设为0可关闭缓存以便做可复现性对比
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+# 内存中最多缓存的决策数
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "4096"))
+# 设置后决策缓存同时持久化到该目录，跨仿真复用
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+# 缓存决策的有效期（秒），设为0时不过期
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+# 是否在LLM模式下对明显占优的骑手状态（包括无可接订单）直接决策而不调用LLM，
+# 设为0时除健康<2强制休息外全部交给LLM
+LLM_DIRECT_DECISIONS = os.getenv("LLM_DIRECT_DECISIONS", "1") != "0"
+# 所有Agent共用一个连接池，最多同时保持的连接数（不应小于并发请求数LLM_MAX_WORKERS）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+# 建立连接和等待响应的超时（秒），避免单个慢请求拖住整小时的并发决策
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "30"))
+# 连接池已满时等待空闲连接的超时（秒），不随读超时放大
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "5"))
+# 超时、限流(429)和5xx时由SDK按指数退避重试的次数，0表示不重试
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
 class DeepSeekClient:
     """DeepSeek API客户端 - 使用OpenAI SDK风格"""
     
@@ -32,12 +75,24 @@ class DeepSeekClient:
         self.base_url = base_url or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
         self.model = model or os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
         
+        self._limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        self._timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT,
+                                      write=LLM_CONNECT_TIMEOUT, pool=LLM_POOL_TIMEOUT)
+        # 异步客户端的连接池绑定在创建它的事件循环上，按事件循环惰性创建，
+        # 每次仿真结束时由aclose关闭
+        self._async_client: Optional[AsyncOpenAI] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        
         # 初始化OpenAI客户端
         if self.api_key:
             try:
                 self.client = OpenAI(
                     api_key=self.api_key,
-                    base_url=self.base_url
+                    base_url=self.base_url,
+                    timeout=self._timeout,
+                    max_retries=LLM_MAX_RETRIES,
+                    http_client=DefaultHttpxClient(limits=self._limits, http2=HTTP2_AVAILABLE)
                 )
                 self.available = True
             except Exception as e:
@@ -48,6 +103,31 @@ class DeepSeekClient:
             self.client = None
             self.available = False
         
+    @property
+    def async_client(self) -> Optional[AsyncOpenAI]:
+        """当前事件循环上的异步客户端，供并发决策使用，与同步客户端共用配置"""
+        if not self.available:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=self._timeout,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=DefaultAsyncHttpxClient(limits=self._limits, http2=HTTP2_AVAILABLE)
+            )
+            self._async_loop = loop
+        return self._async_client
+    
+    async def aclose(self):
+        """在创建异步客户端的事件循环结束前关闭它及其连接池，下次使用时重新创建"""
+        client = self._async_client
+        self._async_client = None
+        self._async_loop = None
+        if client is not None:
+            await client.close()
+        
     def is_available(self) -> bool:
         """检查是否可用"""
         return self.available
@@ -95,6 +175,36 @@ class DeepSeekClient:
             print(f"调用DeepSeek API失败: {e}")
             return None
     
+    async def achat_completion(self, 
+                               messages: List[Dict[str, str]], 
+                               temperature: float = 0.7,
+                               max_tokens: int = 2000,
+                               **kwargs: Any) -> Optional[str]:
+        """chat_completion的异步版本，参数和返回值相同"""
+        if not self.available:
+            return None
+            
+        try:
+            typed_messages = cast(List[ChatCompletionMessageParam], messages)
+            
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=typed_messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **kwargs
+            )
+            
+            if response.choices and len(response.choices) > 0:
+                return response.choices[0].message.content
+            else:
+                print("DeepSeek API返回空响应")
+                return None
+                
+        except Exception as e:
+            print(f"调用DeepSeek API失败: {e}")
+            return None
+    
     def create_completion(self, prompt: str, temperature: float = 0.7, max_tokens: int = 2000) -> Optional[str]:
         """
         创建文本补全（兼容方法）
@@ -135,8 +245,103 @@ class DeepSeekClient:
             print(f"连接测试失败: {e}")
             return False
 
+_json_decoder = json.JSONDecoder()
+
+def parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    从LLM响应中解析JSON对象。
+
+    响应以'{'开头时先整体解析（安装了orjson时用orjson）；否则或整体解析失败时，
+    从第一个'{'开始解析出第一个完整的对象，忽略前后的说明文字和之后的其他JSON块。
+
+    Returns:
+        解析出的字典，没有可解析的对象时返回None
+    """
+    start = text.find('{')
+    if start != -1 and not text[:start].strip():
+        try:
+            result = orjson.loads(text) if orjson is not None else json.loads(text)
+            if isinstance(result, dict):
+                return result
+        except ValueError:  # orjson.JSONDecodeError也是ValueError
+            pass
+    while start != -1:
+        try:
+            result, _ = _json_decoder.raw_decode(text, start)
+            return result
+        except ValueError:
+            start = text.find('{', start + 1)
+    return None
+
+class DecisionCache:
+    """
+    LLM决策缓存，键为(角色, 分桶后的环境和自身状态)。
+
+    实际存储的键是该元组连同namespace（模型、采样温度和系统提示词指纹）的SHA-256摘要，
+    更换模型或修改提示词后不会命中旧的决策。
+    内存中按LRU淘汰，超过ttl秒的决策视为未命中；给定目录时同时写入shelve文件，下次仿真可直接复用。
+    """
+    
+    def __init__(self, maxsize: int = 4096, directory: str = "", ttl: float = 0, namespace: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._store = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._store = shelve.open(os.path.join(directory, "decisions"))
+            atexit.register(self._store.close)
+    
+    def _digest(self, key: Tuple) -> str:
+        payload = json.dumps([self.namespace, key], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """返回缓存决策的副本，未命中或已过期时返回None"""
+        digest = self._digest(key)
+        with self._lock:
+            entry = self._items.get(digest)
+            if entry is not None:
+                self._items.move_to_end(digest)
+            elif self._store is not None:
+                entry = self._store.get(digest)
+                if entry is not None:
+                    self._remember(digest, entry)
+            if entry is not None and self.ttl > 0 and time.time() - entry[0] > self.ttl:
+                del self._items[digest]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry[1])
+    
+    def put(self, key: Tuple, decision: Dict[str, Any]):
+        digest = self._digest(key)
+        entry = (time.time(), dict(decision))
+        with self._lock:
+            self._remember(digest, entry)
+            if self._store is not None:
+                self._store[digest] = entry
+    
+    def _remember(self, digest: str, entry: Tuple[float, Dict[str, Any]]):
+        self._items[digest] = entry
+        self._items.move_to_end(digest)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
 class AgentPrompts:
-    """Agent提示词模板类"""
+    """
+    Agent提示词模板类
+
+    系统提示词只包含固定的角色设定，每次调用保持逐字节相同，以便命中服务端的前缀缓存；
+    随时间变化的环境和自身状态都放在用户消息中。用户消息模板（*_USER）也把固定的
+    决策说明和回答格式放在前面，状态字段放在最后，并用str.format填入。
+    """
     
     # 客户Agent提示词
     CUSTOMER_SYSTEM = """
@@ -148,16 +353,45 @@ class AgentPrompts:
 - 是否用餐时间
 
 请简洁地分析情况并给出决策理由。
+"""
+
+    CUSTOMER_USER = """
+请决定是否点外卖？考虑因素：
+1. 高温对于外出就餐的便利程度
+2. 用餐时间更适合点餐
+3. 历史评分反映服务质量
+
+请回答 {{"order": true/false, "concern_level": "high/medium/low", "reasoning": "决策理由"}}
+
+当前环境:
+- 温度: {temp:.0f}°C
+- 时间: {hour}点 
+- 是否用餐时间: True
+- 我的历史评分均值: {avg_rating:.1f}
+"""
+
+    CUSTOMER_BATCH_USER = """
+每位消费者需要分别决定是否点外卖，考虑因素：
+1. 高温对于外出就餐的便利程度
+2. 用餐时间更适合点餐
+3. 历史评分反映服务质量
+
+请为每位消费者各给出一个决策，只返回JSON对象：
+{{"decisions": [{{"id": "消费者ID", "order": true/false, "concern_level": "high/medium/low", "reasoning": "简短理由"}}]}}
+
+当前环境:
+- 温度: {temp:.0f}°C
+- 时间: {hour}点 
+- 是否用餐时间: True
+
+以下{count}位消费者需要决策：
+{customer_lines}
 """
 
     # 骑手Agent提示词  
     RIDER_SYSTEM = """
 你是一名外卖骑手，你的首要目标是最大化你的收入。健康固然重要，但你需要承担一定风险来赚钱。
-
-你的状态:
-- 健康值: {health}/10
-- 当前资金: {money}元
-- 幸福感: {happiness}/10
+你当前的健康值、资金和幸福感会在每次的工作环境信息中给出。
 
 决策指南:
 - **首要任务是接单**: 只要有订单并且你的健康状况没有到危险水平(低于2)，你就应该接单。
@@ -166,6 +400,41 @@ class AgentPrompts:
 - **生存**: 不工作就没有收入。
 
 请根据环境条件和自身状态，决定你的下一个行动：deliver, rest, 或 complain。
+"""
+
+    RIDER_USER = """
+请选择最佳行动:
+1. deliver - 接单配送 (有收入但可能损害健康)
+2. rest - 休息恢复 (恢复健康但无收入)  
+3. complain - 投诉工作条件 (表达不满)
+
+请回答 {{"action": "deliver/rest/complain", "risk_level": "high/medium/low", "reasoning": "决策理由"}}
+
+当前工作环境:
+- 温度: {temp:.0f}°C (极端高温>40°C)
+- 阴凉覆盖率: {shelter_rate:.1f}
+- 可接订单数: {order_count}
+- 我的健康状况: {health:.1f}/10
+- 当前资金: {money:.0f}元
+- 幸福感: {happiness:.1f}/10
+"""
+
+    RIDER_BATCH_USER = """
+每名骑手需要分别选择行动，可选行动:
+1. deliver - 接单配送 (有收入但可能损害健康)
+2. rest - 休息恢复 (恢复健康但无收入)  
+3. complain - 投诉工作条件 (表达不满)
+
+请为每名骑手各给出一个决策，只返回JSON对象：
+{{"decisions": [{{"id": "骑手ID", "action": "deliver/rest/complain", "risk_level": "high/medium/low", "reasoning": "简短理由"}}]}}
+
+当前工作环境:
+- 温度: {temp:.0f}°C (极端高温>40°C)
+- 阴凉覆盖率: {shelter_rate:.1f}
+- 可接订单数: {order_count}
+
+以下{count}名骑手需要决策：
+{rider_lines}
 """
 
     # 政府Agent提示词
@@ -178,6 +447,22 @@ class AgentPrompts:
 - 维护社会服务秩序
 
 根据当前状况，决定是否发放高温补贴或增设基础设施。
+"""
+
+    GOVERNMENT_USER = """
+请制定政策措施：
+1. 高温补贴：温度>38°C时每人30-50元，>42°C时50-100元
+2. 增设纳凉点：投诉多且覆盖率<0.8时考虑，成本1000元
+3. 紧急程度评估
+
+请回答 {{"subsidy_amount": 数字, "build_shelter": true/false, "urgency": "high/medium/low", "reasoning": "政策理由"}}
+
+当前社会状况:
+- 温度: {temp:.0f}°C
+- 骑手投诉数: {complaints}
+- 健康状况不佳骑手数: {unhealthy_riders}
+- 纳凉点覆盖率: {shelter_rate:.2f}
+- 政府预算: {budget:.0f}元
 """
 
     # 平台Agent提示词
@@ -190,43 +475,145 @@ class AgentPrompts:
 - 平衡收益和社会责任
 
 根据运营数据，做出合适的管理决策。
+"""
+
+    PLATFORM_USER = """
+请做出运营决策：
+1. 薪酬调整：可提高或降低骑手分成比例
+2. 人员管理：是否解雇表现差的骑手
+3. 风险评估：评估当前运营风险
+
+请回答 {{"adjust_pay": 1.0, "fire_riders": false, "risk_level": "low", "reasoning": "决策理由"}}
+
+平台运营状况:
+- 在职骑手数: {active_riders}
+- 今日完成订单: {completed_orders}
+- 骑手平均健康: {avg_health:.1f}/10
+- 收到投诉数: {complaints}
+- 平台资金: {cash:.0f}元
 """
 
 class LLMEnhancedAgent:
-    """LLM增强的Agent基类"""
+    """
+    LLM增强的Agent基类
+
+    与AgentState相同，观察/思考/行动轨迹在第一次记录时才创建，agents.DEBUG_TRACE关闭时不记录；
+    未创建时对应属性返回空元组。决策方式统计不受轨迹开关影响。
+    """
+    
+    __slots__ = ("agent_type", "agent_id", "llm_client", "_observations", "_thoughts", "_actions",
+                 "llm_thought_count", "rule_thought_count")
     
     def __init__(self, agent_type: str, agent_id: str):
         self.agent_type = agent_type
         self.agent_id = agent_id
-        self.llm_client = DeepSeekClient()
-        self.observations = []
-        self.thoughts = []
-        self.actions = []
+        # 所有Agent共用全局客户端及其连接池
+        self.llm_client = deepseek_client
+        # 轨迹只保存原始文本或(模板, 参数)，读取时才格式化
+        self._observations: Optional[TraceLog] = None
+        self._thoughts: Optional[TraceLog] = None
+        self._actions: Optional[TraceLog] = None
+        # 轨迹只保留最近的记录，决策方式统计在记录时累计
+        self.llm_thought_count = 0
+        self.rule_thought_count = 0
+    
+    def _new_trace(self, label: str) -> TraceLog:
+        return TraceLog(f"[{self.agent_type}-{self.agent_id}] {label}: ")
+    
+    @property
+    def observations(self):
+        return self._observations if self._observations is not None else ()
+    
+    @property
+    def thoughts(self):
+        return self._thoughts if self._thoughts is not None else ()
+    
+    @property
+    def actions(self):
+        return self._actions if self._actions is not None else ()
         
-    def add_observation(self, obs: str):
-        """添加观察记录"""
-        self.observations.append(f"[{self.agent_type}-{self.agent_id}] 观察: {obs}")
+    def add_observation(self, obs: str, *args):
+        """添加观察记录；传入args时obs为str.format模板"""
+        if agents.DEBUG_TRACE:
+            if self._observations is None:
+                self._observations = self._new_trace("观察")
+            self._observations.append((obs, args) if args else obs)
         
-    def add_thought(self, thought: str):
-        """添加思考记录"""
-        self.thoughts.append(f"[{self.agent_type}-{self.agent_id}] 思考: {thought}")
+    def add_thought(self, thought: str, *args):
+        """添加思考记录；传入args时thought为str.format模板"""
+        if "LLM" in thought:
+            self.llm_thought_count += 1
+        if "规则" in thought:
+            self.rule_thought_count += 1
+        if agents.DEBUG_TRACE:
+            if self._thoughts is None:
+                self._thoughts = self._new_trace("思考")
+            self._thoughts.append((thought, args) if args else thought)
         
-    def add_action(self, action: str):
-        """添加行动记录"""
-        self.actions.append(f"[{self.agent_type}-{self.agent_id}] 行动: {action}")
+    def add_action(self, action: str, *args):
+        """添加行动记录；传入args时action为str.format模板"""
+        if agents.DEBUG_TRACE:
+            if self._actions is None:
+                self._actions = self._new_trace("行动")
+            self._actions.append((action, args) if args else action)
+    
+    def last_trace(self) -> Tuple[str, str, str]:
+        """最近一次的(观察, 思考, 行动)，供行为日志使用；未记录时为空字符串"""
+        return tuple(trace.last() if trace is not None else ""
+                     for trace in (self._observations, self._thoughts, self._actions))
     
-    def llm_decide(self, system_prompt: str, user_prompt: str) -> Dict[str, Any]:
-        """使用LLM进行决策"""
+    def llm_decide(self, system_prompt: str, user_prompt: str, cache_key: Optional[Tuple] = None) -> Dict[str, Any]:
+        """使用LLM进行决策；给定cache_key时先查决策缓存，LLM给出的决策也写入缓存"""
         if not self.llm_client.is_available():
             return self._fallback_decide(user_prompt)
         
+        cached = self.cached_decision(cache_key)
+        if cached is not None:
+            return cached
+        
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
         
         response = self.llm_client.chat_completion(messages)
+        return self.cache_decision(cache_key, self._handle_llm_response(response, user_prompt))
+    
+    async def allm_decide(self, system_prompt: str, user_prompt: str, cache_key: Optional[Tuple] = None) -> Dict[str, Any]:
+        """llm_decide的异步版本"""
+        if not self.llm_client.is_available():
+            return self._fallback_decide(user_prompt)
+        
+        cached = self.cached_decision(cache_key)
+        if cached is not None:
+            return cached
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
         
+        response = await self.llm_client.achat_completion(messages)
+        return self.cache_decision(cache_key, self._handle_llm_response(response, user_prompt))
+    
+    def cached_decision(self, cache_key: Optional[Tuple]) -> Optional[Dict[str, Any]]:
+        """查询决策缓存，命中时按LLM决策记录轨迹"""
+        if cache_key is None or not LLM_CACHE_ENABLED:
+            return None
+        decision = decision_cache.get(cache_key)
+        if decision is not None:
+            self.record_llm_decision(decision)
+        return decision
+    
+    @staticmethod
+    def cache_decision(cache_key: Optional[Tuple], decision: Dict[str, Any]) -> Dict[str, Any]:
+        """把LLM给出的决策写入缓存（降级得到的规则决策不缓存），原样返回决策"""
+        if cache_key is not None and LLM_CACHE_ENABLED and decision.get("decision_type") != "rule_based":
+            decision_cache.put(cache_key, decision)
+        return decision
+    
+    def _handle_llm_response(self, response: Optional[str], user_prompt: str) -> Dict[str, Any]:
+        """记录LLM响应并解析为决策，无响应时降级"""
         if response:
             self.add_thought(f"LLM分析: {response}")
             
@@ -240,14 +627,9 @@ class LLMEnhancedAgent:
     def _parse_llm_response(self, response: str) -> Dict[str, Any]:
         """解析LLM响应"""
         # 尝试提取JSON格式的决策
-        try:
-            start_idx = response.find('{')
-            end_idx = response.rfind('}') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response[start_idx:end_idx]
-                return json.loads(json_str)
-        except:
-            pass
+        decision = parse_json_object(response)
+        if decision is not None:
+            return decision
         
         # 如果没有JSON，返回文本分析
         return {
@@ -255,6 +637,11 @@ class LLMEnhancedAgent:
             "decision_type": "text_analysis"
         }
     
+    def record_llm_decision(self, decision: Dict[str, Any]):
+        """记录批量LLM调用中分给本Agent的决策"""
+        self.add_thought("LLM分析: {}", decision.get("reasoning", ""))
+        self.add_action("决策: {}", decision)
+    
     def _fallback_decide(self, prompt: str) -> Dict[str, Any]:
         """降级决策方法"""
         self.add_thought("使用规则基础决策")
@@ -263,6 +650,40 @@ class LLMEnhancedAgent:
 # 全局LLM客户端
 deepseek_client = DeepSeekClient()
 agent_prompts = AgentPrompts()
+# 决策缓存的命名空间：llm_decide使用默认采样温度0.7，提示词模板变化后旧决策不再命中
+_cache_namespace = hashlib.sha256("\0".join([
+    deepseek_client.model, "0.7",
+    *(value for name, value in vars(AgentPrompts).items() if name.endswith(("_SYSTEM", "_USER"))),
+]).encode("utf-8")).hexdigest()
+decision_cache = DecisionCache(LLM_CACHE_SIZE, LLM_CACHE_DIR, LLM_CACHE_TTL, _cache_namespace)
+
+async def allm_decide_batch(system_prompt: str, user_prompt: str,
+                            client: Optional[DeepSeekClient] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    一次LLM调用为一批Agent决策。
+
+    要求模型返回 {"decisions": [{"id": ..., ...}, ...]} 形式的JSON对象。
+
+    Returns:
+        按Agent ID索引的决策；调用失败或无法解析时为空，缺少的Agent由调用方降级处理
+    """
+    client = client or deepseek_client
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    response = await client.achat_completion(messages, response_format={"type": "json_object"})
+    if not response:
+        return {}
+    
+    parsed = parse_json_object(response)
+    if parsed is None:
+        print("批量决策响应无法解析为JSON")
+        return {}
+    items = parsed.get("decisions", [])
+    if not isinstance(items, list):
+        return {}
+    return {str(item["id"]): item for item in items if isinstance(item, dict) and "id" in item}
 
 def check_llm_status():
     """检查LLM状态"""
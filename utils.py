@@ -4,80 +4,261 @@
 
 import json
 import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 import matplotlib.pyplot as plt
 import numpy as np
 
+try:
+    import orjson  # 可选依赖，保存日志时序列化更快
+except ImportError:
+    orjson = None
+
+from environment import EnvState
+
+# 订单归档文件的记录格式，可用 np.fromfile / np.memmap 按该dtype读回做回溯分析
+ORDER_RECORD_DTYPE = np.dtype([
+    ("order_id", "S36"),
+    ("customer_id", "S32"),
+    ("rider_id", "S32"),
+    ("day", "<i4"),
+    ("time", "<i1"),
+    ("cost", "<f4"),
+    ("distance", "<f4"),
+    ("tip", "<f4"),
+    ("rating", "<i1"),  # 未评分为0
+    ("delivered", "?"),
+])
+
+class OrderArchive:
+    """只追加的订单二进制归档，每天结束时写入当天的订单后即可释放内存中的订单列表"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        # 每次仿真重新开始写
+        open(self.path, "wb").close()
+        
+    def append(self, orders: List) -> None:
+        """追加一批订单记录"""
+        if not orders:
+            return
+        records = np.array([
+            (o.order_id, o.customer_id, o.rider_id or "", o.day, o.time,
+             o.cost, o.distance, o.tip, o.rating or 0, o.delivered)
+            for o in orders
+        ], dtype=ORDER_RECORD_DTYPE)
+        with open(self.path, "ab") as f:
+            records.tofile(f)
+            
+    def load(self) -> np.ndarray:
+        """以内存映射方式读回全部订单记录"""
+        return np.memmap(self.path, dtype=ORDER_RECORD_DTYPE, mode="r")
+
 class SimulationLogger:
-    """仿真数据记录器"""
+    """
+    仿真数据记录器
+
+    给定stream_path时，Agent行为日志每天由flush_stream以JSON Lines追加写入该文件后从内存释放，
+    内存中只保留尚未写出的部分；save_logs保存的JSON中以logs_file指向该文件，不再内联日志。
+    """
     
-    def __init__(self):
-        self.logs = []
+    def __init__(self, expected_events: int = 1024, stream_path: Optional[str] = None):
+        # Agent行为日志按列存放：数值列为预分配的NumPy数组，容量不足时翻倍；
+        # Agent类型/ID和观察/思考/行动文本都编码为字符串表中的下标
+        capacity = max(1, expected_events)
+        self._n = 0
+        self._day = np.empty(capacity, dtype=np.int32)
+        self._hour = np.empty(capacity, dtype=np.int8)
+        self._agent_type = np.empty(capacity, dtype=np.int32)
+        self._agent_id = np.empty(capacity, dtype=np.int32)
+        self._observation = np.empty(capacity, dtype=np.int32)
+        self._thought = np.empty(capacity, dtype=np.int32)
+        self._action = np.empty(capacity, dtype=np.int32)
+        self._strings: List[str] = []
+        self._string_codes: Dict[str, int] = {}
+        self.stream_path = stream_path
+        self.streamed_count = 0  # 已写入stream_path的日志条数
+        if stream_path:
+            open(stream_path, 'w').close()
         self.daily_stats = []
         self.rider_stats = []
         self.customer_stats = []
         self.environment_stats = []
+        self._frames: Dict[str, Any] = {}  # _stats_frame的缓存：名称 -> (记录条数, DataFrame)
+        
+    def _code(self, text: str) -> int:
+        """返回字符串在字符串表中的下标，首次出现时加入"""
+        code = self._string_codes.get(text)
+        if code is None:
+            code = len(self._strings)
+            self._string_codes[text] = code
+            self._strings.append(text)
+        return code
+    
+    def _grow(self):
+        """日志列容量翻倍"""
+        for name in ("_day", "_hour", "_agent_type", "_agent_id", "_observation", "_thought", "_action"):
+            column = getattr(self, name)
+            grown = np.empty(column.shape[0] * 2, dtype=column.dtype)
+            grown[:self._n] = column[:self._n]
+            setattr(self, name, grown)
         
     def log_agent_action(self, day: int, hour: int, agent_type: str, agent_id: str, 
                         observation: str, thought: str, action: str):
         """记录Agent的行为"""
-        log_entry = {
-            "timestamp": f"Day{day}-Hour{hour}",
-            "day": day,
-            "hour": hour,
-            "agent_type": agent_type,
-            "agent_id": agent_id,
-            "observation": observation,
-            "thought": thought,
-            "action": action
-        }
-        self.logs.append(log_entry)
+        n = self._n
+        if n == self._day.shape[0]:
+            self._grow()
+        code = self._code
+        self._day[n] = day
+        self._hour[n] = hour
+        self._agent_type[n] = code(agent_type)
+        self._agent_id[n] = code(agent_id)
+        self._observation[n] = code(observation)
+        self._thought[n] = code(thought)
+        self._action[n] = code(action)
+        self._n = n + 1
+    
+    def log_agent_actions(self, day: int, hour: int, agent_type: str, entries: List[Tuple[str, str, str, str]]):
+        """
+        一次记录同一小时、同类型的多个Agent的行为，结果与逐条调用log_agent_action相同。
+
+        Args:
+            entries: (agent_id, observation, thought, action)列表
+        """
+        count = len(entries)
+        if not count:
+            return
+        start = self._n
+        while start + count > self._day.shape[0]:
+            self._grow()
+        end = start + count
+        code = self._code
+        self._day[start:end] = day
+        self._hour[start:end] = hour
+        self._agent_type[start:end] = code(agent_type)
+        self._agent_id[start:end] = [code(entry[0]) for entry in entries]
+        self._observation[start:end] = [code(entry[1]) for entry in entries]
+        self._thought[start:end] = [code(entry[2]) for entry in entries]
+        self._action[start:end] = [code(entry[3]) for entry in entries]
+        self._n = end
+    
+    def _log_entries(self, indices) -> List[Dict[str, Any]]:
+        """把指定行的日志还原为字典"""
+        strings = self._strings
+        entries = []
+        for i in indices:
+            day, hour = int(self._day[i]), int(self._hour[i])
+            entries.append({
+                "timestamp": f"Day{day}-Hour{hour}",
+                "day": day,
+                "hour": hour,
+                "agent_type": strings[self._agent_type[i]],
+                "agent_id": strings[self._agent_id[i]],
+                "observation": strings[self._observation[i]],
+                "thought": strings[self._thought[i]],
+                "action": strings[self._action[i]]
+            })
+        return entries
+    
+    @property
+    def logs(self) -> List[Dict[str, Any]]:
+        """内存中的Agent行为日志（字典列表）；未设置stream_path时即全部日志"""
+        return self._log_entries(range(self._n))
+    
+    def flush_stream(self):
+        """把内存中的行为日志以JSON Lines追加写入stream_path并清空，未设置stream_path时不做任何事"""
+        if not self.stream_path or not self._n:
+            return
+        entries = self._log_entries(range(self._n))
+        if orjson is not None:
+            with open(self.stream_path, 'ab') as f:
+                f.write(b"".join(orjson.dumps(entry) + b"\n" for entry in entries))
+        else:
+            with open(self.stream_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        self.streamed_count += self._n
+        self._n = 0
+        self._strings.clear()
+        self._string_codes.clear()
         
     def log_daily_stats(self, day: int, riders: List, customers: List, 
-                       orders: List, environment_state: Dict, government, platform):
-        """记录每日统计数据"""
+                       total_orders: int, completed_orders: int, environment_state: EnvState, government, platform,
+                       rider_arrays=None):
+        """
+        记录每日统计数据
+
+        rider_arrays为riders对应的骑手结构数组（如RiderArray）时，按列一次取出各骑手的状态并求均值，
+        不再逐个读取骑手属性。
+        """
         
         # 骑手统计
-        rider_data = []
-        for rider in riders:
-            rider_data.append({
-                "day": day,
-                "rider_id": rider.agent_id,
-                "health": rider.health,
-                "money": rider.money,
-                "happiness": rider.happiness,
-                "orders_completed": rider.orders_completed,
-                "daily_income": rider.daily_income,
-                "on_duty": rider.on_duty,
-                "complaints": len(rider.complaints)
-            })
+        if rider_arrays is not None:
+            columns = (rider_arrays.health, rider_arrays.money, rider_arrays.happiness,
+                       rider_arrays.orders_completed, rider_arrays.daily_income, rider_arrays.on_duty,
+                       rider_arrays.complaint_count)
+            rows = zip([rider.agent_id for rider in riders], *(column.tolist() for column in columns))
+        else:
+            rows = ((rider.agent_id, rider.health, rider.money, rider.happiness, rider.orders_completed,
+                     rider.daily_income, rider.on_duty, len(rider.complaints)) for rider in riders)
+        rider_data = [{
+            "day": day,
+            "rider_id": rider_id,
+            "health": health,
+            "money": money,
+            "happiness": happiness,
+            "orders_completed": orders_completed,
+            "daily_income": daily_income,
+            "on_duty": on_duty,
+            "complaints": complaints
+        } for rider_id, health, money, happiness, orders_completed, daily_income, on_duty, complaints in rows]
         self.rider_stats.extend(rider_data)
         
         # 整体日统计
+        n_riders = len(rider_data)
+        if rider_arrays is not None and n_riders:
+            avg_health = float(rider_arrays.health.mean())
+            avg_happiness = float(rider_arrays.happiness.mean())
+            total_complaints = int(rider_arrays.complaint_count.sum())
+        elif n_riders:
+            avg_health = sum(r["health"] for r in rider_data) / n_riders
+            avg_happiness = sum(r["happiness"] for r in rider_data) / n_riders
+            total_complaints = sum(r["complaints"] for r in rider_data)
+        else:
+            avg_health = avg_happiness = float("nan")
+            total_complaints = 0
         daily_stat = {
             "day": day,
-            "avg_temperature": np.mean([environment_state["temperature"]]),  # 简化处理
-            "total_orders": len(orders),
-            "completed_orders": len([o for o in orders if o.delivered]),
-            "avg_rider_health": np.mean([r.health for r in riders]),
-            "avg_rider_happiness": np.mean([r.happiness for r in riders]),
-            "total_complaints": sum(len(r.complaints) for r in riders),
+            "avg_temperature": float(environment_state.temperature),  # 简化处理
+            "total_orders": total_orders,
+            "completed_orders": completed_orders,
+            "avg_rider_health": avg_health,
+            "avg_rider_happiness": avg_happiness,
+            "total_complaints": total_complaints,
             "government_subsidies": government.subsidies_paid,
             "shelters_built": government.shelters_built,
             "platform_revenue": platform.daily_revenue,
-            "shelter_rate": environment_state["shelter_rate"]
+            "shelter_rate": environment_state.shelter_rate
         }
         self.daily_stats.append(daily_stat)
         
     def save_logs(self, filename: str = "simulation_logs.json"):
-        """保存日志到文件"""
+        """保存日志到文件；安装了orjson时用它序列化，输出格式与json.dump相同"""
+        data = {
+            "logs": self.logs,
+            "daily_stats": self.daily_stats,
+            "rider_stats": self.rider_stats
+        }
+        if self.stream_path:
+            self.flush_stream()
+            del data["logs"]
+            data = {"logs_file": self.stream_path, **data}
+        if orjson is not None:
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+            return
         with open(filename, 'w', encoding='utf-8') as f:
-            json.dump({
-                "logs": self.logs,
-                "daily_stats": self.daily_stats,
-                "rider_stats": self.rider_stats
-            }, f, ensure_ascii=False, indent=2)
+            json.dump(data, f, ensure_ascii=False, indent=2)
             
     def print_daily_summary(self, day: int):
         """打印每日摘要"""
@@ -94,23 +275,33 @@ class SimulationLogger:
             print(f"新建纳凉点: {stats['shelters_built']}个")
             print(f"阴凉覆盖率: {stats['shelter_rate']:.2f}")
         
-        # 打印最近的Agent行为
-        recent_logs = [log for log in self.logs if log['day'] == day]
-        print(f"\n今日Agent行为记录 ({len(recent_logs)}条):")
-        for log in recent_logs[-10:]:  # 只显示最近10条
+        # 打印最近的Agent行为；日志按时间顺序记录，同一天的行在day列上连续，二分查找即可定位
+        days = self._day[:self._n]
+        start, end = np.searchsorted(days, day, side="left"), np.searchsorted(days, day, side="right")
+        print(f"\n今日Agent行为记录 ({end - start}条):")
+        for log in self._log_entries(range(max(start, end - 10), end)):  # 只显示最近10条
             print(f"  {log['timestamp']} [{log['agent_type']}-{log['agent_id']}]")
             print(f"    观察: {log['observation']}")
             print(f"    思考: {log['thought']}")
             print(f"    行动: {log['action']}")
             print()
     
+    def _stats_frame(self, name: str) -> pd.DataFrame:
+        """把daily_stats/rider_stats转为DataFrame；统计只会追加，条数不变时复用上次的结果"""
+        records = getattr(self, name)
+        cached = self._frames.get(name)
+        if cached is None or cached[0] != len(records):
+            cached = (len(records), pd.DataFrame(records))
+            self._frames[name] = cached
+        return cached[1]
+    
     def plot_simulation_results(self):
         """绘制仿真结果图表"""
         if not self.daily_stats:
             print("没有数据可绘制")
             return
             
-        df = pd.DataFrame(self.daily_stats)
+        df = self._stats_frame("daily_stats")
         
         fig, axes = plt.subplots(2, 3, figsize=(18, 12))
         fig.suptitle('极端高温下外卖配送仿真结果', fontsize=16)
@@ -169,47 +360,33 @@ class SimulationLogger:
             print("没有骑手数据可分析")
             return
             
-        df = pd.DataFrame(self.rider_stats)
-        riders = df['rider_id'].unique()
+        df = self._stats_frame("rider_stats")
         
         fig, axes = plt.subplots(2, 2, figsize=(15, 10))
         fig.suptitle('骑手个体表现分析', fontsize=16)
         
+        # 按骑手分组一次，每个骑手的数据依次画到四个子图上
+        panels = ((axes[0, 0], 'health'), (axes[0, 1], 'happiness'),
+                  (axes[1, 0], 'money'), (axes[1, 1], 'orders_completed'))
+        for rider_id, rider_data in df.groupby('rider_id', sort=False):
+            for ax, column in panels:
+                ax.plot(rider_data['day'], rider_data[column], marker='o', label=f'骑手{rider_id}')
+        
         # 健康变化
-        for rider_id in riders:
-            rider_data = df[df['rider_id'] == rider_id]
-            axes[0, 0].plot(rider_data['day'], rider_data['health'], marker='o', label=f'骑手{rider_id}')
         axes[0, 0].set_ylabel('健康水平')
         axes[0, 0].set_title('骑手健康变化')
-        axes[0, 0].legend()
-        axes[0, 0].grid(True, alpha=0.3)
-        
         # 幸福感变化
-        for rider_id in riders:
-            rider_data = df[df['rider_id'] == rider_id]
-            axes[0, 1].plot(rider_data['day'], rider_data['happiness'], marker='o', label=f'骑手{rider_id}')
         axes[0, 1].set_ylabel('幸福感')
         axes[0, 1].set_title('骑手幸福感变化')
-        axes[0, 1].legend()
-        axes[0, 1].grid(True, alpha=0.3)
-        
         # 收入变化
-        for rider_id in riders:
-            rider_data = df[df['rider_id'] == rider_id]
-            axes[1, 0].plot(rider_data['day'], rider_data['money'], marker='o', label=f'骑手{rider_id}')
         axes[1, 0].set_ylabel('总资产 (元)')
         axes[1, 0].set_title('骑手资产变化')
-        axes[1, 0].legend()
-        axes[1, 0].grid(True, alpha=0.3)
-        
         # 订单完成情况
-        for rider_id in riders:
-            rider_data = df[df['rider_id'] == rider_id]
-            axes[1, 1].plot(rider_data['day'], rider_data['orders_completed'], marker='o', label=f'骑手{rider_id}')
         axes[1, 1].set_ylabel('累计订单数')
         axes[1, 1].set_title('骑手订单完成数')
-        axes[1, 1].legend()
-        axes[1, 1].grid(True, alpha=0.3)
+        for ax, _ in panels:
+            ax.legend()
+            ax.grid(True, alpha=0.3)
         
         for ax in axes.flat:
             ax.set_xlabel('仿真天数')